@@ -0,0 +1,166 @@
+import json
+import os
+import random
+import tracemalloc
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import pygame
+
+from controls import InputState
+from profiler import summarize
+from models import LevelWindow
+from pg_utilities import read_bin_level_data, write_level_in_bin
+from single_objects import level_cache
+
+TICKS = 600
+TOLERANCE = 0.25
+NOISE_FLOOR_MS = 1.0
+WINDOW_SIZE = 1000, 800
+DOT_SIZE = 64
+
+# (name, width, height, wall density, button/gate pairs, players)
+CASES = (
+    ('small', 15, 12, 0.15, 2, 2),
+    ('medium', 64, 64, 0.15, 8, 2),
+    ('dense', 64, 64, 0.40, 8, 2),
+    ('logic', 64, 64, 0.15, 128, 4),
+    ('crowd', 64, 64, 0.15, 8, 8),
+    ('large', 255, 255, 0.15, 32, 4),
+    ('huge', 512, 512, 0.15, 64, 4),
+)
+
+# Metrics where a larger value is better; the rest are costs.
+HIGHER_IS_BETTER = ('ticks_per_second',)
+
+
+def generate_level(width, height, wall_density=0.15, gates=8, players=2, seed=0):
+    rng = random.Random(seed)
+    level = [[0x01 if x in (0, width - 1) or y in (0, height - 1) or rng.random() < wall_density else 0x00
+              for x in range(width)] for y in range(height)]
+    cells = [(x, y) for y in range(1, height - 1) for x in range(1, width - 1)]
+    places = iter(rng.sample(cells, min(len(cells), players + gates * 2 + 1)))
+
+    for player_id in range(players):
+        x, y = next(places)
+        level[y][x] = 0xF0 + player_id
+    for i in range(gates):
+        x, y = next(places)
+        level[y][x] = 0x10 + i % 16
+        x, y = next(places)
+        level[y][x] = (0x20, 0x30)[i % 2] + i % 16
+    x, y = next(places)
+    level[y][x] = 0x03
+    return tuple(map(tuple, level))
+
+
+def scripted_inputs(ticks, seed=0):
+    rng = random.Random(seed)
+    inputs = InputState()
+    for tick in range(ticks):
+        if tick % 15 == 0:
+            up, left = rng.random() < 0.5, rng.random() < 0.5
+            inputs = InputState(up=up, left=left, down=not up, right=not left,
+                                shift=rng.random() < 0.2, tab=rng.random() < 0.1)
+        yield inputs
+
+
+def run_case(screen, path, ticks=TICKS, seed=0):
+    start = perf_counter()
+    read_bin_level_data(path)
+    load_time = perf_counter() - start
+
+    level_cache.clear()
+    tracemalloc.start()
+    start = perf_counter()
+    window = LevelWindow(path, dot_size=DOT_SIZE, window_width=screen.get_width(), window_height=screen.get_height())
+    window_time = perf_counter() - start
+    window.kill_sprites()
+    start = perf_counter()
+    window.load_sprites()
+    load_sprites_time = perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    screen.fill((0, 0, 0))
+    frame_times = []
+    for inputs in scripted_inputs(ticks, seed):
+        start = perf_counter()
+        window.scene.input_state.set(inputs)
+        window.scene.scheduler.update()
+        window.draw(screen)
+        frame_times.append((perf_counter() - start) * 1000)
+    window.kill_sprites()
+    level_cache.clear()
+
+    frames = summarize(frame_times)
+    return {
+        'load_ms': load_time * 1000,
+        'window_ms': window_time * 1000,
+        'load_sprites_ms': load_sprites_time * 1000,
+        'ticks_per_second': len(frame_times) / (sum(frame_times) / 1000),
+        **{f'frame_{name}_ms': value for name, value in frames.items()},
+        'peak_memory_kb': peak_memory / 1024,
+    }
+
+
+def run_benchmarks(cases=CASES, ticks=TICKS, seed=0, directory=None):
+    pygame.font.init()
+    screen = pygame.display.set_mode(WINDOW_SIZE)
+    results = {}
+    with TemporaryDirectory() as temporary:
+        for name, width, height, wall_density, gates, players in cases:
+            path = os.path.join(directory or temporary, f'bench_{name}.bin')
+            write_level_in_bin(generate_level(width, height, wall_density, gates, players, seed), path)
+            results[name] = {'size': f'{width}x{height}', 'walls': wall_density, 'gates': gates, 'players': players,
+                             **run_case(screen, path, ticks, seed)}
+            yield name, results[name]
+
+
+def regressions(results, baseline, tolerance=TOLERANCE):
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get(name, {}).get(metric)
+            if not isinstance(old, float) or not old:
+                continue
+            if metric.endswith('_ms') and max(old, value) < NOISE_FLOOR_MS:
+                continue
+            change = (old - value if metric in HIGHER_IS_BETTER else value - old) / old
+            if change > tolerance:
+                yield name, metric, old, value
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Run the game on generated stress levels and record timings.')
+    parser.add_argument('cases', nargs='*', help='case names to run (all by default)')
+    parser.add_argument('-t', '--ticks', type=int, default=TICKS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--out', metavar='PATH', help='write results as a JSON baseline')
+    parser.add_argument('-c', '--compare', metavar='PATH', help='report metrics worse than this baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--levels', metavar='DIR', help='keep generated levels in this directory')
+    args = parser.parse_args()
+
+    selected = [case for case in CASES if not args.cases or case[0] in args.cases]
+    results = {}
+    for case_name, case_result in run_benchmarks(selected, args.ticks, args.seed, args.levels):
+        results[case_name] = case_result
+        print(f"{case_name:>8} {case_result['size']:>9}: load {case_result['load_ms']:7.2f} ms, "
+              f"sprites {case_result['load_sprites_ms']:8.2f} ms, {case_result['ticks_per_second']:7.0f} ticks/s, "
+              f"p99 {case_result['frame_p99_ms']:6.2f} ms, peak {case_result['peak_memory_kb']:8.0f} KiB")
+
+    if args.out:
+        with open(args.out, 'w', encoding='UTF-8') as file:
+            json.dump({'ticks': args.ticks, 'seed': args.seed, 'cases': results}, file, indent=1)
+
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as file:
+            baseline = json.load(file)['cases']
+        failed = list(regressions(results, baseline, args.tolerance))
+        for case_name, metric, old, new in failed:
+            print(f'regression in {case_name}: {metric} {old:.2f} -> {new:.2f}')
+        if failed:
+            raise SystemExit(1)
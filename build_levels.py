@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from level_format import parse_txt_level, encode_level, RAW, ZLIB, RLE
+
+MANIFEST = 'levels.manifest.json'
+COMPRESSIONS = {'raw': RAW, 'zlib': ZLIB, 'rle': RLE}
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as file:
+            digest = hashlib.sha256()
+            for block in iter(lambda: file.read(1 << 16), b''):
+                digest.update(block)
+            return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def hashed_lines(file, digest):
+    for line in file:
+        digest.update(line)
+        yield line.decode('UTF-8')
+
+
+def build_level(source, output, known=None, options=(None, ZLIB)):
+    # Returns (source, status, source hash, output hash). A level is skipped
+    # when its text and the .bin written last time are both unchanged.
+    if known is not None and known['options'] == list(options) and file_hash(source) == known['source'] \
+            and file_hash(output) == known['output']:
+        return source, 'unchanged', known['source'], known['output']
+    digest = hashlib.sha256()
+    try:
+        with open(source, 'rb') as file:
+            level = parse_txt_level(hashed_lines(file, digest))
+        encoded = encode_level(level, *options)
+    except (OSError, UnicodeDecodeError, ValueError) as error:
+        return source, f'error: {error}', None, None
+    source_hash = digest.hexdigest()
+    temporary = output + '.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(encoded)
+        os.replace(temporary, output)
+    except OSError as error:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return source, f'error: {error}', None, None
+    return source, 'built', source_hash, hashlib.sha256(encoded).hexdigest()
+
+
+def build_levels(source_dir, output_dir=None, processes=None, force=False, version=None, compression=ZLIB):
+    output_dir = output_dir or source_dir
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    manifest = {}
+    if not force and os.path.isfile(manifest_path):
+        with open(manifest_path, encoding='UTF-8') as file:
+            manifest = json.load(file)
+
+    names = sorted(name for name in os.listdir(source_dir) if name.endswith('.txt'))
+    jobs = [(os.path.join(source_dir, name), os.path.join(output_dir, name[:-4] + '.bin'),
+             manifest.get(name), (version, compression)) for name in names]
+    results = {}
+    with Pool(processes) as pool:
+        for source, status, source_hash, output_hash in pool.starmap(build_level, jobs, chunksize=8):
+            name = os.path.basename(source)
+            results[name] = status
+            if source_hash is not None:
+                manifest[name] = {'source': source_hash, 'output': output_hash, 'options': [version, compression]}
+            else:
+                manifest.pop(name, None)
+
+    for name in set(manifest) - set(names):
+        del manifest[name]
+    with open(manifest_path, 'w', encoding='UTF-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    return results
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Convert a directory of .txt levels to .bin, skipping unchanged ones.')
+    parser.add_argument('source', nargs='?', default='data/levels')
+    parser.add_argument('-o', '--output', help='directory for the .bin files (the source directory by default)')
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild every level')
+    parser.add_argument('--version', type=int, choices=(1, 2), default=None)
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='zlib')
+    args = parser.parse_args()
+
+    build_results = build_levels(args.source, args.output, args.processes, args.force,
+                                 args.version, COMPRESSIONS[args.compression])
+    for level_name, level_status in build_results.items():
+        if level_status != 'unchanged':
+            print(f'{level_name}: {level_status}')
+    built = sum(status == 'built' for status in build_results.values())
+    failed = sum(status.startswith('error') for status in build_results.values())
+    print(f'{built} built, {len(build_results) - built - failed} unchanged, {failed} failed')
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,63 @@
+from pygame import Rect
+
+
+class Camera:
+    def __init__(self, width, height, world: Rect):
+        self.width = width
+        self.height = height
+        self.world = world
+        self.x = 0
+        self.y = 0
+
+    @property
+    def offset(self):
+        return self.x, self.y
+
+    @property
+    def view(self):
+        return Rect(self.x, self.y, self.width, self.height)
+
+    @staticmethod
+    def clamp(value, low, high):
+        # A world narrower than the screen stays where the level indents put it.
+        if high < low:
+            return 0
+        return max(low, min(value, high))
+
+    def follow(self, rect):
+        self.x = self.clamp(rect.centerx - self.width // 2, self.world.left, self.world.right - self.width)
+        self.y = self.clamp(rect.centery - self.height // 2, self.world.top, self.world.bottom - self.height)
+
+
+class ChunkedWorld:
+    def __init__(self, group, chunk_size, x=0, y=0):
+        self.group = group
+        self.chunk_size = chunk_size
+        self.x = x
+        self.y = y
+        self.chunks = {}
+        self.active = set()
+
+    def chunk_key(self, x, y):
+        return int((x - self.x) // self.chunk_size), int((y - self.y) // self.chunk_size)
+
+    def add(self, sprite):
+        key = self.chunk_key(*sprite.rect.center)
+        self.chunks.setdefault(key, []).append(sprite)
+        if key not in self.active:
+            self.group.remove(sprite)
+
+    def activate(self, view: Rect, margin=1):
+        first_x, first_y = self.chunk_key(view.left, view.top)
+        last_x, last_y = self.chunk_key(view.right - 1, view.bottom - 1)
+        keys = {(chunk_x, chunk_y) for chunk_x in range(first_x - margin, last_x + margin + 1)
+                for chunk_y in range(first_y - margin, last_y + margin + 1)}
+        for key in self.active - keys:
+            self.group.remove(*self.chunks.get(key, ()))
+        for key in keys - self.active:
+            self.group.add(*self.chunks.get(key, ()))
+        self.active = keys
+
+    def clear(self):
+        self.chunks.clear()
+        self.active.clear()
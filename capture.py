@@ -0,0 +1,119 @@
+import gzip
+import os
+import struct
+import threading
+import zlib
+from time import perf_counter
+
+import numpy as np
+import pygame
+
+# Frames are copied straight out of the display surface's pixel buffer into a
+# preallocated ring, and an encoder thread writes them out. When the ring is
+# full the new frame is dropped instead of waiting for the encoder. The
+# encoder only calls into zlib and file writes, which release the GIL, so it
+# doesn't hold up the game loop (pygame.image.save would).
+CAPTURE_FPS = 30
+CAPTURE_FRAMES = 32
+RAW_FORMATS = {(0xFF0000, 0xFF00, 0xFF): 'bgr0', (0xFF, 0xFF00, 0xFF0000): 'rgb0'}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def raw_format(surface: pygame.Surface):
+    if surface.get_bytesize() != 4:
+        return None
+    return RAW_FORMATS.get(tuple(surface.get_masks()[:3]))
+
+
+def png_chunk(tag, data):
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+
+def encode_png(rgb: np.ndarray, level=1):
+    height, width, _ = rgb.shape
+    rows = np.zeros((height, width * 3 + 1), np.uint8)
+    rows[:, 1:] = rgb.reshape(height, -1)
+    return (PNG_SIGNATURE + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            png_chunk(b'IDAT', zlib.compress(rows, level)) + png_chunk(b'IEND', b''))
+
+
+class FrameCapture:
+    # path ending in .raw or .raw.gz: one raw video stream, anything else: a
+    # directory of numbered PNG files.
+    def __init__(self, path, surface: pygame.Surface, fps=CAPTURE_FPS, capacity=CAPTURE_FRAMES):
+        self.path = path
+        self.size = surface.get_size()
+        self.row_bytes = self.size[0] * surface.get_bytesize()
+        self.format = raw_format(surface)
+        if self.format is None:
+            raise ValueError(f'Cannot capture {surface.get_bitsize()}-bit frames')
+        self.interval = 1 / fps
+        self.fps = fps
+        self.next_capture = perf_counter()
+
+        self.ring = np.empty((capacity, self.size[1], surface.get_pitch()), np.uint8)
+        self.head = self.tail = 0
+        self.captured = self.written = self.dropped = 0
+        self.running = True
+        self.ready = threading.Condition()
+
+        if path.endswith(('.raw', '.raw.gz')):
+            self.file = (gzip.open(path, 'wb', compresslevel=1) if path.endswith('.gz') else open(path, 'wb'))
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.file = None
+        self.encoder = threading.Thread(target=self.encode, daemon=True)
+        self.encoder.start()
+
+    def capture(self, surface: pygame.Surface):
+        now = perf_counter()
+        if now < self.next_capture:
+            return False
+        self.next_capture = max(self.next_capture + self.interval, now)
+        self.captured += 1
+        if self.head - self.tail == len(self.ring):
+            self.dropped += 1
+            return False
+        pixels = surface.get_buffer()
+        np.copyto(self.ring[self.head % len(self.ring)], np.frombuffer(pixels, np.uint8).reshape(self.ring.shape[1:]))
+        del pixels
+        with self.ready:
+            self.head += 1
+            self.ready.notify()
+        return True
+
+    def encode(self):
+        while True:
+            with self.ready:
+                while self.head == self.tail and self.running:
+                    self.ready.wait()
+                if self.head == self.tail:
+                    return
+            slot = self.ring[self.tail % len(self.ring)]
+            if self.file is not None:
+                self.file.write(np.ascontiguousarray(slot[:, :self.row_bytes]))
+            else:
+                pixels = slot[:, :self.row_bytes].reshape(self.size[1], self.size[0], 4)
+                with open(os.path.join(self.path, f'{self.written:06d}.png'), 'wb') as file:
+                    file.write(encode_png(pixels[..., 2::-1] if self.format == 'bgr0' else pixels[..., :3]))
+            self.written += 1
+            with self.ready:
+                self.tail += 1
+
+    def close(self):
+        with self.ready:
+            self.running = False
+            self.ready.notify()
+        self.encoder.join()
+        if self.file is not None:
+            self.file.close()
+
+    def report(self):
+        text = f'{self.written}/{self.captured} frames written to {self.path}, {self.dropped} dropped'
+        if self.file is not None:
+            source = f'-i {self.path}'
+            if self.path.endswith('.gz'):
+                source = f'-i - < <(gunzip -c {self.path})'
+            text += (f'\nffmpeg -f rawvideo -pix_fmt {self.format} -s {self.size[0]}x{self.size[1]} '
+                     f'-r {self.fps} {source} out.mp4')
+        return text
@@ -0,0 +1,86 @@
+from pygame import Rect
+
+
+class Solid:
+    __slots__ = ('rect',)
+
+    def __init__(self, rect):
+        self.rect = rect
+
+
+class CollisionGrid:
+    def __init__(self, width=0, height=0, cell_size=64, x=0, y=0, profiler=None):
+        self.profiler = profiler
+        self.reset(width, height, cell_size, x, y)
+
+    def reset(self, width, height, cell_size=64, x=0, y=0):
+        self.width = width
+        self.height = height
+        self.cell_size = cell_size
+        self.x = x
+        self.y = y
+        self.cells = [None] * (width * height)
+
+    def cell_index(self, x, y):
+        column = int((x - self.x) // self.cell_size)
+        row = int((y - self.y) // self.cell_size)
+        if 0 <= column < self.width and 0 <= row < self.height:
+            return row * self.width + column
+        return None
+
+    def add(self, sprite):
+        index = self.cell_index(sprite.rect.x, sprite.rect.y)
+        if index is not None:
+            self.cells[index] = sprite
+
+    def add_solid(self, column, row):
+        if 0 <= column < self.width and 0 <= row < self.height:
+            self.cells[row * self.width + column] = Solid(Rect(self.x + column * self.cell_size,
+                                                               self.y + row * self.cell_size,
+                                                               self.cell_size, self.cell_size))
+
+    def remove(self, sprite):
+        index = self.cell_index(sprite.rect.x, sprite.rect.y)
+        if index is not None and self.cells[index] is sprite:
+            self.cells[index] = None
+
+    def cell_range(self, rect):
+        first_column = max(int((rect.left - self.x) // self.cell_size), 0)
+        last_column = min(int((rect.right - 1 - self.x) // self.cell_size), self.width - 1)
+        first_row = max(int((rect.top - self.y) // self.cell_size), 0)
+        last_row = min(int((rect.bottom - 1 - self.y) // self.cell_size), self.height - 1)
+        return first_column, last_column, first_row, last_row
+
+    def colliding(self, rect):
+        first_column, last_column, first_row, last_row = self.cell_range(rect)
+        for row in range(first_row, last_row + 1):
+            offset = row * self.width
+            for column in range(first_column, last_column + 1):
+                sprite = self.cells[offset + column]
+                if sprite is not None and sprite.rect.colliderect(rect):
+                    yield sprite
+
+    def collideany(self, rect):
+        if self.profiler is not None:
+            self.profiler.count('collision_queries')
+        return next(self.colliding(rect), None)
+
+    def sweep(self, rect, dx=0, dy=0):
+        # Moves along one axis at a time: returns the part of (dx, dy)
+        # the rect can travel before touching a solid cell.
+        if self.profiler is not None:
+            self.profiler.count('collision_queries')
+        if dx:
+            area = Rect(rect.right if dx > 0 else rect.left + dx, rect.top, abs(dx), rect.height)
+        else:
+            area = Rect(rect.left, rect.bottom if dy > 0 else rect.top + dy, rect.width, abs(dy))
+        for sprite in self.colliding(area):
+            if dx > 0:
+                dx = min(dx, sprite.rect.left - rect.right)
+            elif dx < 0:
+                dx = max(dx, sprite.rect.right - rect.left)
+            elif dy > 0:
+                dy = min(dy, sprite.rect.top - rect.bottom)
+            elif dy < 0:
+                dy = max(dy, sprite.rect.bottom - rect.top)
+        return dx, dy
@@ -0,0 +1,33 @@
+from typing import NamedTuple
+
+import pygame
+from pygame.locals import (
+    K_w, K_UP,
+    K_a, K_LEFT,
+    K_s, K_DOWN,
+    K_d, K_RIGHT,
+    K_LSHIFT, K_RSHIFT,
+    K_TAB
+)
+
+
+class InputState(NamedTuple):
+    up: bool = False
+    left: bool = False
+    down: bool = False
+    right: bool = False
+    shift: bool = False
+    tab: bool = False
+
+    @classmethod
+    def from_keys(cls, keys):
+        return cls(up=bool(keys[K_w] or keys[K_UP]),
+                   left=bool(keys[K_a] or keys[K_LEFT]),
+                   down=bool(keys[K_s] or keys[K_DOWN]),
+                   right=bool(keys[K_d] or keys[K_RIGHT]),
+                   shift=bool(keys[K_LSHIFT] or keys[K_RSHIFT]),
+                   tab=bool(keys[K_TAB]))
+
+
+def read_keyboard():
+    return InputState.from_keys(pygame.key.get_pressed())
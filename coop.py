@@ -0,0 +1,367 @@
+import asyncio
+import os
+import struct
+from argparse import ArgumentParser
+from collections import deque
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pygame
+
+from controls import InputState, read_keyboard
+from models import LevelWindow
+from profiler import summarize
+from replay import pack_inputs, unpack_inputs, write_varint, read_varint, level_hash
+from scene import Scene
+from simulation import Simulation
+
+PORT = 7346
+TICK_RATE = 60
+# A client whose socket still holds this much unsent data gets no snapshot
+# this tick, so a slow client costs at most this many bytes per tick.
+MAX_BUFFERED = 4096
+MAX_QUEUED_INPUTS = 8
+
+# Every message is a FRAME header followed by its payload.
+FRAME = struct.Struct('<HB')
+WELCOME = struct.Struct('<BB20sH')
+INPUT = struct.Struct('<IB')
+SNAPSHOT = struct.Struct('<IIB')
+WELCOME_MESSAGE, INPUT_MESSAGE, SNAPSHOT_MESSAGE, FULL_MESSAGE = range(4)
+KEYFRAME, WON = 1, 2
+
+
+def message(kind, payload=b''):
+    return FRAME.pack(len(payload), kind) + payload
+
+
+async def read_message(reader: asyncio.StreamReader):
+    size, kind = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return kind, await reader.readexactly(size)
+
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def scene_state(scene: Scene):
+    # Player positions by id, then one bit per button and gate in build order.
+    positions = tuple(player.rect.topleft for player in sorted(scene.player_sprites, key=lambda p: p.player_id))
+    bits = [button.active for button in scene.button_sprites] + [gate.active for gate in scene.gate_sprites]
+    masks = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        masks[i // 8] |= bit << i % 8
+    return positions, bytes(masks)
+
+
+def encode_snapshot(tick, ack, state, previous=None, won=False):
+    positions, masks = state
+    keyframe = previous is None
+    if keyframe:
+        previous = ((0, 0),) * len(positions), bytes(len(masks))
+    data = bytearray(SNAPSHOT.pack(tick, ack, KEYFRAME * keyframe | WON * won))
+    changed = [i for i, (position, old) in enumerate(zip(positions, previous[0])) if position != old]
+    data.append(sum(1 << i for i in changed))
+    for i in changed:
+        write_varint(data, zigzag(positions[i][0] - previous[0][i][0]))
+        write_varint(data, zigzag(positions[i][1] - previous[0][i][1]))
+    flips = [(i, new ^ old) for i, (new, old) in enumerate(zip(masks, previous[1])) if new != old]
+    write_varint(data, len(flips))
+    for i, flip in flips:
+        write_varint(data, i)
+        data.append(flip)
+    return bytes(data)
+
+
+def decode_snapshot(data, previous):
+    tick, ack, flags = SNAPSHOT.unpack_from(data)
+    positions, masks = previous
+    if flags & KEYFRAME:
+        positions, masks = ((0, 0),) * len(positions), bytes(len(masks))
+    positions, masks = list(positions), bytearray(masks)
+    offset = SNAPSHOT.size + 1
+    for i in range(len(positions)):
+        if data[SNAPSHOT.size] >> i & 1:
+            dx, offset = read_varint(data, offset)
+            dy, offset = read_varint(data, offset)
+            positions[i] = positions[i][0] + unzigzag(dx), positions[i][1] + unzigzag(dy)
+    flips, offset = read_varint(data, offset)
+    for _ in range(flips):
+        i, offset = read_varint(data, offset)
+        masks[i] ^= data[offset]
+        offset += 1
+    return tick, ack, bool(flags & WON), (tuple(positions), bytes(masks))
+
+
+class Connection:
+    def __init__(self, player_id, writer: asyncio.StreamWriter):
+        self.player_id = player_id
+        self.writer = writer
+        self.inputs = deque(maxlen=MAX_QUEUED_INPUTS)
+        self.ack = 0
+        self.sent = None
+        self.bytes = []
+        self.skipped = 0
+
+
+class CoopServer:
+    def __init__(self, path, tick_rate=TICK_RATE, max_buffered=MAX_BUFFERED):
+        self.path = path
+        self.tick_rate = tick_rate
+        self.max_buffered = max_buffered
+        self.simulation = Simulation(path)
+        self.scene = self.simulation.scene
+        self.scene.player_inputs = {}
+        self.connections = {}
+        self.tick_times = []
+        self.ticks = 0
+        self.levels_won = 0
+
+    async def handle(self, reader, writer):
+        free = [i for i in range(int(self.scene.number_players)) if i not in self.connections]
+        if not free:
+            writer.write(message(FULL_MESSAGE))
+            writer.close()
+            return
+        connection = self.connections[free[0]] = Connection(free[0], writer)
+        path = self.path.encode('UTF-8')
+        writer.write(message(WELCOME_MESSAGE, WELCOME.pack(connection.player_id, self.tick_rate,
+                                                           level_hash(self.path), len(path)) + path))
+        try:
+            while True:
+                kind, payload = await read_message(reader)
+                if kind == INPUT_MESSAGE:
+                    connection.inputs.append(INPUT.unpack(payload))
+        except (asyncio.IncompleteReadError, ConnectionError, struct.error):
+            # A closed or misbehaving client just loses its player.
+            pass
+        finally:
+            del self.connections[connection.player_id]
+            self.scene.player_inputs.pop(connection.player_id, None)
+            writer.close()
+
+    def step(self):
+        start = perf_counter()
+        # One queued input per client and tick; a client whose input is late
+        # stands still and is corrected by the snapshot.
+        for connection in self.connections.values():
+            inputs = InputState()
+            if connection.inputs:
+                connection.ack, mask = connection.inputs.popleft()
+                inputs = unpack_inputs(mask)
+            self.scene.player_inputs[connection.player_id] = inputs
+        self.simulation.step()
+        self.ticks += 1
+        won = self.simulation.won
+        state = scene_state(self.scene)
+        for connection in self.connections.values():
+            if not won and connection.writer.transport.get_write_buffer_size() > self.max_buffered:
+                connection.sent = None
+                connection.skipped += 1
+                continue
+            data = message(SNAPSHOT_MESSAGE, encode_snapshot(self.ticks, connection.ack, state,
+                                                             connection.sent, won))
+            connection.writer.write(data)
+            connection.sent = state
+            connection.bytes.append(len(data))
+        if won:
+            # Clients restart the level when they see the win flag, so the
+            # session carries on with the same players.
+            self.levels_won += 1
+            self.simulation.restart()
+        self.tick_times.append((perf_counter() - start) * 1000)
+
+    async def serve(self, host='127.0.0.1', port=PORT, ticks=None):
+        server = await asyncio.start_server(self.handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        async with server:
+            next_tick = perf_counter()
+            while ticks is None or self.ticks < ticks:
+                self.step()
+                next_tick += 1 / self.tick_rate
+                await asyncio.sleep(max(0., next_tick - perf_counter()))
+
+
+class CoopClient:
+    def __init__(self, headless=True, window_width=1000, window_height=800):
+        self.headless = headless
+        self.window_width = window_width
+        self.window_height = window_height
+        self.window = None
+        self.player = None
+        self.sequence = 0
+        self.history = deque()
+        self.state = None
+        self.levels_won = 0
+        self.corrections = 0
+
+    async def connect(self, host='127.0.0.1', port=PORT):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        kind, payload = await read_message(self.reader)
+        if kind != WELCOME_MESSAGE:
+            raise ConnectionError("The level is full")
+        player_id, self.tick_rate, digest, path_size = WELCOME.unpack_from(payload)
+        path = payload[WELCOME.size:WELCOME.size + path_size].decode('UTF-8')
+        if level_hash(path) != digest:
+            raise ValueError(f"'{path}' differs from the server's level")
+        self.window = LevelWindow(path, window_width=self.window_width, window_height=self.window_height,
+                                  headless=self.headless)
+        self.scene = self.window.scene
+        self.scene.player_inputs = {}
+        self.scene.active_player_id.set(player_id)
+        self.players = {player.player_id: player for player in self.scene.player_sprites}
+        self.player = self.players[player_id]
+        self.state = scene_state(self.scene)
+        self.receiver = asyncio.create_task(self.receive())
+
+    def step(self, inputs: InputState):
+        # Runs the tick locally straight away and remembers where it left the
+        # player, to be checked against the server once it has run it too.
+        self.sequence += 1
+        self.writer.write(message(INPUT_MESSAGE, INPUT.pack(self.sequence, pack_inputs(inputs))))
+        self.scene.player_inputs[self.player.player_id] = inputs
+        self.scene.scheduler.update()
+        self.history.append((self.sequence, inputs, self.player.rect.topleft))
+
+    async def receive(self):
+        try:
+            while True:
+                kind, payload = await read_message(self.reader)
+                if kind == SNAPSHOT_MESSAGE:
+                    self.apply(payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    def apply(self, payload):
+        _, ack, won, self.state = decode_snapshot(payload, self.state)
+        positions, masks = self.state
+        for player_id, player in self.players.items():
+            if player is not self.player:
+                self.place(player, positions[player_id])
+
+        predicted = None
+        while self.history and self.history[0][0] <= ack:
+            predicted = self.history.popleft()[2]
+        if predicted is not None and predicted != positions[self.player.player_id]:
+            # The server disagrees: restart from its position and replay the
+            # inputs it has not seen yet.
+            self.corrections += 1
+            self.place(self.player, positions[self.player.player_id])
+            for i, (sequence, inputs, _) in enumerate(self.history):
+                self.player.control(inputs)
+                self.history[i] = sequence, inputs, self.player.rect.topleft
+
+        buttons = len(self.scene.button_sprites)
+        for i, gate in enumerate(self.scene.gate_sprites, start=buttons):
+            gate.logic_update(bool(masks[i // 8] >> i % 8 & 1))
+
+        if won:
+            # The server restarts the level right after this snapshot. Inputs
+            # it has not seen yet are replayed on the new level by the next
+            # correction.
+            self.levels_won += 1
+            self.window.restart()
+            self.players = {player.player_id: player for player in self.scene.player_sprites}
+            self.player = self.players[self.player.player_id]
+
+    def place(self, player, position):
+        if player.rect.topleft != position:
+            old = player.rect.copy()
+            player.rect.topleft = position
+            player.dirty = 1
+            self.scene.entity_store.move_player(player.entity_index, player.rect)
+            self.scene.scheduler.wake_area(old.union(player.rect))
+
+    def close(self):
+        self.receiver.cancel()
+        self.writer.close()
+        self.window.kill_sprites()
+
+
+async def play(host, port):
+    pygame.display.init()
+    pygame.font.init()
+    screen = pygame.display.set_mode((1000, 800))
+    client = CoopClient(headless=False)
+    await client.connect(host, port)
+    pygame.display.set_caption(f'Player {client.player.player_id + 1}')
+    next_tick = perf_counter()
+    while not any(event.type == pygame.QUIT for event in pygame.event.get()):
+        client.step(read_keyboard())
+        pygame.display.update(client.window.draw(screen))
+        next_tick += 1 / client.tick_rate
+        await asyncio.sleep(max(0., next_tick - perf_counter()))
+    client.close()
+
+
+async def bot(client, inputs, ticks, tick_rate):
+    next_tick = perf_counter()
+    for tick_inputs, _ in zip(inputs, range(ticks)):
+        client.step(tick_inputs)
+        next_tick += 1 / tick_rate
+        await asyncio.sleep(max(0., next_tick - perf_counter()))
+
+
+async def benchmark(path, clients=8, ticks=600, tick_rate=TICK_RATE):
+    from benchmark import scripted_inputs
+
+    server = CoopServer(path, tick_rate)
+    serving = asyncio.create_task(server.serve(port=0, ticks=ticks + tick_rate))
+    while not hasattr(server, 'port'):
+        await asyncio.sleep(0)
+    bots = [CoopClient() for _ in range(clients)]
+    for client in bots:
+        await client.connect(port=server.port)
+    await asyncio.gather(*(bot(client, scripted_inputs(ticks, seed), ticks, tick_rate)
+                           for seed, client in enumerate(bots)))
+    await asyncio.sleep(0.5)
+    sent = [size for connection in server.connections.values() for size in connection.bytes]
+    in_sync = all(client.player.rect.topleft == client.state[0][client.player.player_id] for client in bots)
+    report = {
+        'clients': len(server.connections),
+        'server_tick_ms': summarize(server.tick_times),
+        'snapshot_bytes': summarize(sent),
+        'skipped_snapshots': sum(connection.skipped for connection in server.connections.values()),
+        'corrections': sum(client.corrections for client in bots),
+        'in_sync': in_sync,
+    }
+    for client in bots:
+        client.close()
+    serving.cancel()
+    await asyncio.gather(serving, return_exceptions=True)
+    return report
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Co-op mode: one server runs the level, every client plays one player.')
+    parser.add_argument('mode', choices=('server', 'client', 'bench'))
+    parser.add_argument('level', nargs='?', help='level for the server and the benchmark')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--clients', type=int, default=8, help='stand-in clients for the benchmark')
+    parser.add_argument('--ticks', type=int, default=600, help='ticks the benchmark runs for')
+    args = parser.parse_args()
+
+    if args.mode == 'server':
+        print(f'Serving {args.level} on {args.host}:{args.port}')
+        asyncio.run(CoopServer(args.level).serve(args.host, args.port))
+    elif args.mode == 'client':
+        asyncio.run(play(args.host, args.port))
+    else:
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        with TemporaryDirectory() as directory:
+            if args.level is None:
+                from benchmark import generate_level
+                from pg_utilities import write_level_in_bin
+
+                args.level = os.path.join(directory, 'coop.bin')
+                write_level_in_bin(generate_level(32, 24, 0.1, 16, args.clients), args.level)
+            bench_report = asyncio.run(benchmark(args.level, args.clients, args.ticks))
+        for name, value in bench_report.items():
+            if isinstance(value, dict):
+                value = ', '.join(f'{key} {number:.2f}' for key, number in value.items())
+            print(f'{name}: {value}')
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+def overlaps(first, second):
+    # (n, 4) and (m, 4) arrays of left, top, right, bottom -> (n, m) colliderect table.
+    return ((first[:, None, 0] < second[None, :, 2]) & (second[None, :, 0] < first[:, None, 2]) &
+            (first[:, None, 1] < second[None, :, 3]) & (second[None, :, 1] < first[:, None, 3]))
+
+
+class RectArray:
+    def __init__(self, capacity=16):
+        self.rects = np.zeros((capacity, 4), np.int32)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def add(self, rect):
+        if self.length == len(self.rects):
+            self.rects = np.concatenate((self.rects, np.zeros_like(self.rects)))
+        self.rects[self.length] = rect.left, rect.top, rect.right, rect.bottom
+        self.length += 1
+        return self.length - 1
+
+    def set(self, index, rect):
+        self.rects[index] = rect.left, rect.top, rect.right, rect.bottom
+
+    def view(self):
+        return self.rects[:self.length]
+
+
+class EntityStore:
+    # Players, buttons and wins keep a copy of their rect here. After a player
+    # moves, each kind of overlap is recounted for all entities at once the
+    # first time it is asked for.
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.players = RectArray()
+        self.buttons = RectArray()
+        self.wins = RectArray()
+        self.counts = {}
+
+    def add_player(self, rect):
+        self.counts.clear()
+        return self.players.add(rect)
+
+    def add_button(self, rect):
+        self.counts.clear()
+        return self.buttons.add(rect)
+
+    def add_win(self, rect):
+        self.counts.clear()
+        return self.wins.add(rect)
+
+    def move_player(self, index, rect):
+        self.players.set(index, rect)
+        self.counts.clear()
+
+    def player_counts(self, entities: RectArray):
+        counts = self.counts.get(id(entities))
+        if counts is None:
+            hits = overlaps(self.players.view(), entities.view())
+            if entities is self.players:
+                np.fill_diagonal(hits, False)
+            counts = self.counts[id(entities)] = hits.sum(axis=0)
+        return counts
+
+    def players_on_button(self, index):
+        return int(self.player_counts(self.buttons)[index])
+
+    def players_on_win(self, index):
+        return int(self.player_counts(self.wins)[index])
+
+    def touches_player(self, index):
+        return bool(self.player_counts(self.players)[index])
@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+import pygame
+from pygame.font import Font
+
+FONT_PATH = 'data/fonts/BrassMono-Regular.ttf'
+TEXT_CACHE_SIZE = 256
+
+fonts = {}
+texts = OrderedDict()
+texts_lock = threading.Lock()
+atlases = {}
+
+
+def get_font(size, path=FONT_PATH):
+    key = (path, size)
+    font = fonts.get(key)
+    if font is None:
+        font = fonts[key] = Font(path, size)
+    return font
+
+
+def render_text(font: Font, text, color, antialias=True):
+    key = (font, text, tuple(pygame.Color(color)), antialias)
+    # Surfaces are rendered before they are published and the LRU order is
+    # only touched under the lock, as prewarm threads share these caches.
+    with texts_lock:
+        surface = texts.get(key)
+        if surface is not None:
+            texts.move_to_end(key)
+            return surface
+    surface = font.render(text, antialias, color)
+    with texts_lock:
+        texts[key] = surface
+        if len(texts) > TEXT_CACHE_SIZE:
+            texts.popitem(last=False)
+    return surface
+
+
+def glyph_atlas(font: Font, color, antialias=True):
+    key = (font, tuple(pygame.Color(color)), antialias)
+    atlas = atlases.get(key)
+    if atlas is None:
+        atlas = GlyphAtlas(font, color, antialias)
+        atlases[key] = atlas
+    return atlas
+
+
+class GlyphAtlas:
+    def __init__(self, font: Font, color, antialias=True, characters='0123456789./'):
+        self.font = font
+        self.color = color
+        self.antialias = antialias
+        self.height = font.get_height()
+        self.glyphs = {}
+        for character in characters:
+            self.glyph(character)
+
+    def glyph(self, character):
+        surface = self.glyphs.get(character)
+        if surface is None:
+            surface = self.font.render(character, self.antialias, self.color)
+            self.glyphs[character] = surface
+        return surface
+
+    def size(self, text):
+        return sum(self.glyph(character).get_width() for character in text), self.height
+
+    def blit(self, surface, text, position):
+        x, y = position
+        for character in text:
+            glyph = self.glyph(character)
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
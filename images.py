@@ -0,0 +1,70 @@
+import pygame
+
+from pg_utilities import BUTTON_COLORS, PLAYER_COLORS
+
+BACKGROUND_COLOR = (32, 32, 32)
+
+images = {}
+
+
+def plain_background(width, height):
+    background = pygame.Surface((width, height))
+    background.fill(BACKGROUND_COLOR)
+    return background
+
+
+def tile_image(kind, tile_id=0, active=False, size=64):
+    key = (kind, tile_id, active, size)
+    image = images.get(key)
+    if image is None:
+        # Painted before it is published: prewarm threads share this cache.
+        image = pygame.Surface((size, size), pygame.SRCALPHA, 32)
+        painters[kind](image, tile_id, active, size)
+        images[key] = image
+    return image
+
+
+def paint_wall(image, fill_color, active, size):
+    pygame.draw.rect(image, fill_color,
+                     (0, 0, size, size))
+
+
+def paint_gate(image, gate_id, active, size, type_or=True):
+    color = BUTTON_COLORS[active is False][gate_id]
+    pygame.draw.rect(image, color,
+                     (0, 0, size, size), size // 8)
+    if active:
+        pygame.draw.rect(image, pygame.SRCALPHA,
+                         (size // 4, 0, size // 8, size), size // 8)
+        pygame.draw.rect(image, pygame.SRCALPHA,
+                         (size * 0.625, 0, size // 8, size), size // 8)
+        pygame.draw.rect(image, pygame.SRCALPHA,
+                         (0, size // 4, size, size // 8), size // 8)
+        pygame.draw.rect(image, pygame.SRCALPHA,
+                         (0, size * 0.625, size, size // 8), size // 8)
+    if not type_or:
+        pygame.draw.rect(image, color,
+                         (size // 4, size // 4, size // 2, size // 2), size // 8)
+
+
+def paint_and_gate(image, gate_id, active, size):
+    paint_gate(image, gate_id, active, size, type_or=False)
+
+
+def paint_button(image, button_id, active, size):
+    pygame.draw.rect(image, BUTTON_COLORS[active][button_id],
+                     (0, 0, size, size), size // 4)
+
+
+def paint_player(image, player_id, active, size):
+    pygame.draw.rect(image, PLAYER_COLORS[player_id],
+                     (0, 0, size, size))
+
+
+painters = {
+    'wall': paint_wall,
+    'or_gate': paint_gate,
+    'and_gate': paint_and_gate,
+    'button': paint_button,
+    'player': paint_player,
+}
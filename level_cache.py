@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+
+from images import plain_background
+from pg_utilities import read_bin_level_data
+from static_layer import StaticLayer
+
+CACHE_BYTES = 256 * 1024 * 1024
+
+# Buckets in build order: gates and wins (kept in grid order, they share a
+# layer), walls, buttons after the gates they drive, players last.
+GATES_AND_WINS, WALLS, BUTTONS, PLAYERS = range(4)
+TILE_BUCKETS = tuple(GATES_AND_WINS if dot == 0x03 or 0x20 <= dot <= 0x3F else
+                     WALLS if dot == 0x01 else
+                     BUTTONS if 0x10 <= dot <= 0x1F else
+                     PLAYERS if 0xF0 <= dot <= 0xF7 else None for dot in range(256))
+
+
+def classify_level(level):
+    buckets = ([], [], [], [])
+    for y, line in enumerate(level):
+        for x, dot in enumerate(line):
+            if dot:
+                bucket = TILE_BUCKETS[dot]
+                if bucket is not None:
+                    buckets[bucket].append((x, y, dot))
+    return buckets
+
+
+class CachedLevel:
+    def __init__(self, path, dot_size=64, window_width=800, window_height=800, static_walls=True):
+        self.path = path
+        self.level = read_bin_level_data(path)
+        self.level_width, self.level_height = len(self.level[0]), len(self.level)
+        self.buckets = classify_level(self.level)
+        self.number_players = len({dot for _, _, dot in self.buckets[PLAYERS]})
+        self.static_layer: StaticLayer = None
+        self.background = None
+        self.fixed_size = 8 * self.level_width * self.level_height + 80 * sum(map(len, self.buckets))
+        if static_walls:
+            self.bake_static_layer(dot_size, window_width, window_height)
+
+    def bake_static_layer(self, dot_size, window_width, window_height):
+        self.static_layer = StaticLayer(self.level, dot_size,
+                                        (window_width - self.level_width * dot_size) // 2,
+                                        (window_height - self.level_height * dot_size) // 2)
+        self.background = plain_background(window_width, window_height)
+        self.static_layer.blit(self.background)
+        self.fixed_size += window_width * window_height * self.background.get_bytesize()
+
+    @property
+    def size(self):
+        return self.fixed_size + (self.static_layer.size() if self.static_layer is not None else 0)
+
+
+class LevelCache:
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.levels = OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, dot_size=64, window_width=800, window_height=800, static_walls=True):
+        key = (path, dot_size, window_width, window_height, static_walls)
+        with self.lock:
+            level = self.levels.get(key)
+            if level is not None:
+                self.levels.move_to_end(key)
+                self.evict()
+                return level
+            loaded = self.loading.get(key)
+            if loaded is None:
+                loaded = self.loading[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            loaded.wait()
+            return self.get(*key)
+
+        level = None
+        try:
+            level = CachedLevel(*key)
+        finally:
+            # Waiters wake up to find either the level or nothing, never a
+            # gap in between where they would load it again.
+            with self.lock:
+                if level is not None:
+                    self.levels[key] = level
+                    self.levels.move_to_end(key)
+                    self.evict()
+                del self.loading[key]
+                loaded.set()
+        return level
+
+    @property
+    def size(self):
+        # Summed on demand: static layers of cached levels grow as chunks are painted.
+        return sum(level.size for level in self.levels.values())
+
+    def evict(self):
+        size = self.size
+        while size > self.max_bytes and len(self.levels) > 1:
+            size -= self.levels.popitem(last=False)[1].size
+
+    def prefetch(self, paths, dot_size=64, window_width=800, window_height=800, static_walls=True):
+        thread = threading.Thread(target=self.load_all,
+                                  args=(paths, dot_size, window_width, window_height, static_walls),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def load_all(self, paths, dot_size=64, window_width=800, window_height=800, static_walls=True):
+        for path in paths:
+            try:
+                self.get(path, dot_size, window_width, window_height, static_walls)
+            except (OSError, ValueError) as error:
+                print(f"Не удалось загрузить уровень '{path}': {error}")
+
+    def clear(self):
+        with self.lock:
+            self.levels.clear()
@@ -0,0 +1,152 @@
+import struct
+import zlib
+
+# v1: width u8, height u8, then width * height tile bytes row by row.
+# v2: header, chunk table, chunks. Each chunk holds CHUNK_ROWS rows and is
+#     stored raw, zlib-compressed or run-length encoded.
+MAGIC = b'AIRL'
+HEADER = struct.Struct('<4sBHHH')
+CHUNK_ENTRY = struct.Struct('<BII')
+CHUNK_ROWS = 64
+
+RAW, ZLIB, RLE = range(3)
+
+# Tile codes documented in models.py: empty, wall, OR/AND win, buttons,
+# OR/AND gates and players.
+VALID_TILES = bytes((0x00, 0x01, 0x02, 0x03, *range(0x10, 0x40), *range(0xF0, 0xF8)))
+# Every spelling of a tile code a text level may use, lower-cased: 1 or 2 hex
+# digits with an optional 0x prefix ('1', '01', '0x1', '0x01').
+TILE_TOKENS = {spelling: tile for tile in range(256)
+               for spelling in (f'{tile:x}', f'{tile:02x}', f'0x{tile:x}', f'0x{tile:02x}')}
+
+
+def rle_encode(data):
+    encoded = bytearray()
+    i = 0
+    while i < len(data):
+        value = data[i]
+        run = 1
+        while run < 255 and i + run < len(data) and data[i + run] == value:
+            run += 1
+        encoded += bytes((run, value))
+        i += run
+    return bytes(encoded)
+
+
+SINGLE_BYTES = tuple(bytes((value,)) for value in range(256))
+
+
+def rle_decode(data):
+    data = bytes(data)
+    return b''.join(SINGLE_BYTES[value] * run for run, value in zip(data[::2], data[1::2]))
+
+
+encoders = {RAW: bytes, ZLIB: zlib.compress, RLE: rle_encode}
+decoders = {RAW: bytes, ZLIB: zlib.decompress, RLE: rle_decode}
+
+
+def encode_chunk(data, compression):
+    if compression not in encoders:
+        raise ValueError(f"Unknown chunk compression {compression}")
+    return encoders[compression](data)
+
+
+def decode_chunk(data, compression):
+    if compression not in decoders:
+        raise ValueError(f"Unknown chunk compression {compression}")
+    try:
+        return decoders[compression](data)
+    except zlib.error as error:
+        raise ValueError(f"Corrupt chunk: {error}") from None
+
+
+def split_rows(data, width, height):
+    if len(data) != width * height:
+        raise ValueError(f"Chunk holds {len(data)} tiles, expected {width * height}")
+    return tuple(tuple(data[row * width:(row + 1) * width]) for row in range(height))
+
+
+def parse_txt_level(lines):
+    # Text levels are rows of comma separated hex tile codes.
+    rows = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        tokens = line.split(',')
+        try:
+            row = bytes(TILE_TOKENS[token.strip().lower()] for token in tokens)
+        except KeyError:
+            column = next(i for i, token in enumerate(tokens, start=1) if token.strip().lower() not in TILE_TOKENS)
+            raise ValueError(f"line {number}, column {column}: not a hex tile code "
+                             f"'{tokens[column - 1].strip()}'") from None
+        invalid = row.translate(None, VALID_TILES)
+        if invalid:
+            raise ValueError(f"line {number}, column {row.index(invalid[0]) + 1}: unknown tile {invalid[0]:02X}")
+        if rows and len(row) != len(rows[0]):
+            raise ValueError(f"line {number}: {len(row)} tiles, expected {len(rows[0])}")
+        rows.append(row)
+    if not rows:
+        raise ValueError("empty level")
+    return rows
+
+
+def read_txt_level(path):
+    with open(path, encoding='UTF-8') as file:
+        return parse_txt_level(file)
+
+
+def decode_level(data):
+    if data[:len(MAGIC)] == MAGIC:
+        if len(data) < HEADER.size:
+            raise ValueError("Truncated level header")
+        _, version, width, height, chunk_rows = HEADER.unpack_from(data)
+        if version != 2:
+            raise ValueError(f"Unsupported level version {version}")
+        if not (width and height and chunk_rows):
+            raise ValueError("Empty level")
+        chunks = -(-height // chunk_rows)
+        if len(data) < HEADER.size + chunks * CHUNK_ENTRY.size:
+            raise ValueError("Truncated chunk table")
+        rows = []
+        for i in range(chunks):
+            compression, offset, size = CHUNK_ENTRY.unpack_from(data, HEADER.size + i * CHUNK_ENTRY.size)
+            if offset + size > len(data):
+                raise ValueError(f"Chunk {i} runs past the end of the file")
+            chunk = decode_chunk(data[offset:offset + size], compression)
+            rows.extend(split_rows(chunk, width, min(chunk_rows, height - i * chunk_rows)))
+        return tuple(rows)
+    if len(data) < 2:
+        raise ValueError("Not a level file")
+    width, height = data[0], data[1]
+    if not (width and height):
+        raise ValueError("Empty level")
+    if len(data) != 2 + width * height:
+        raise ValueError("Not a level file")
+    return split_rows(data[2:], width, height)
+
+
+def read_level(path):
+    with open(path, 'rb') as file:
+        return decode_level(file.read())
+
+
+def encode_level(level_data, version=None, compression=ZLIB, chunk_rows=CHUNK_ROWS):
+    width, height = len(level_data[0]), len(level_data)
+    if version is None:
+        version = 1 if width <= 255 and height <= 255 else 2
+    if version == 1:
+        return bytes((width, height)) + b''.join(map(bytes, level_data))
+
+    chunks = [encode_chunk(b''.join(map(bytes, level_data[row:row + chunk_rows])), compression)
+              for row in range(0, height, chunk_rows)]
+    offset = HEADER.size + CHUNK_ENTRY.size * len(chunks)
+    table = bytearray()
+    for chunk in chunks:
+        table += CHUNK_ENTRY.pack(compression, offset, len(chunk))
+        offset += len(chunk)
+    return HEADER.pack(MAGIC, 2, width, height, chunk_rows) + table + b''.join(chunks)
+
+
+def write_level(level_data, path, version=None, compression=ZLIB):
+    with open(path, 'wb') as file:
+        file.write(encode_level(level_data, version, compression))
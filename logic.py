@@ -0,0 +1,44 @@
+IDS = 16
+
+
+class LogicCircuit:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buttons = [0] * IDS
+        self.pressed = [0] * IDS
+        self.pressed_any = 0
+        self.pressed_all = 0
+        self.gates = [[] for _ in range(IDS)]
+
+    def add_button(self, button):
+        self.buttons[button.button_id] += 1
+        if button.active:
+            self.pressed[button.button_id] += 1
+        self.update_masks(button.button_id)
+
+    def add_gate(self, gate):
+        self.gates[gate.gate_id].append(gate)
+
+    def gate_state(self, gate):
+        mask = self.pressed_any if gate.type_or else self.pressed_all
+        return bool(mask >> gate.gate_id & 1)
+
+    def set_button(self, button_id, active):
+        self.pressed[button_id] += 1 if active else -1
+        if self.update_masks(button_id):
+            for gate in self.gates[button_id]:
+                gate.logic_update(self.gate_state(gate))
+
+    def update_masks(self, button_id):
+        bit = 1 << button_id
+        pressed_any = self.pressed_any & ~bit
+        pressed_all = self.pressed_all & ~bit
+        if self.pressed[button_id] > 0:
+            pressed_any |= bit
+            if self.pressed[button_id] == self.buttons[button_id]:
+                pressed_all |= bit
+        changed = (pressed_any, pressed_all) != (self.pressed_any, self.pressed_all)
+        self.pressed_any, self.pressed_all = pressed_any, pressed_all
+        return changed
@@ -1,35 +1,179 @@
+from time import perf_counter
+
+startup_times = [('start', perf_counter())]
+
+import os
+import threading
+from argparse import ArgumentParser
+
 import pygame
-from models import MainWindow
-from single_objects import (
-    all_sprites
-)
+from models import MainWindow, LevelWindow, ProfilerOverlay, prewarm_assets
+from controls import InputState, read_keyboard
+from replay import ReplayRecorder, replay_path
+from capture import FrameCapture, CAPTURE_FPS
+from single_objects import profiler, run_history
+
+startup_times.append(('imports', perf_counter()))
+
+parser = ArgumentParser()
+parser.add_argument('--profile', action='store_true', help='start with the frame profiler on (F3 toggles it)')
+parser.add_argument('--profile-out', metavar='PATH', help='write profiler samples to a .json or .csv file on exit')
+parser.add_argument('--record', metavar='DIR', help='save the inputs of every played level into DIR')
+parser.add_argument('--history', metavar='DIR', help='keep completion times in DIR (default: data/history)')
+parser.add_argument('--capture', metavar='PATH', help='record the screen into a directory of PNGs or a .raw/.raw.gz video')
+parser.add_argument('--capture-fps', type=int, default=CAPTURE_FPS, help='frames per second to capture')
+parser.add_argument('--startup-profile', action='store_true', help='print how long each startup stage took')
+args = parser.parse_args()
+if args.record:
+    os.makedirs(args.record, exist_ok=True)
+if args.history:
+    run_history.directory = args.history
+
+
+def start_recording(window):
+    if args.record and isinstance(window, LevelWindow):
+        return ReplayRecorder(window.path, int(window.scene.active_player_id))
+    return None
+
+
+def stop_recording(recorder):
+    if recorder is not None and recorder.ticks:
+        recorder.save(replay_path(args.record, recorder.level_path))
+
 
+def print_startup_times(times):
+    for (_, previous), (stage, time) in zip(times, times[1:]):
+        print(f'{stage:>12}: {(time - previous) * 1000:8.1f} ms ({(time - times[0][1]) * 1000:8.1f} ms total)')
+
+
+def prewarm():
+    start = perf_counter()
+    prewarm_assets(64, width, height)
+    if args.startup_profile:
+        print(f'{"prewarm":>12}: {(perf_counter() - start) * 1000:8.1f} ms (in the background)')
+
+
+# Only the subsystems the game uses: pygame.init() would also open audio.
+pygame.display.init()
 pygame.font.init()
-pygame.init()
+startup_times.append(('pygame init', perf_counter()))
 
 size = width, height = 1000, 800
 screen = pygame.display.set_mode(size)
+startup_times.append(('display', perf_counter()))
+capture = FrameCapture(args.capture, screen, args.capture_fps) if args.capture else None
 
 clock = pygame.time.Clock()
 running = True
-FPS = 60
+FPS = 240
+TICK_RATE = 60
+TICK = 1 / TICK_RATE
+MAX_TICKS_PER_FRAME = 5
+DIRTY_RENDERING = True
 
 active_window = MainWindow(window_width=width, window_height=height,
-                           dot_size=64)
+                           dot_size=64, prefetch=False)
+profiler_overlay = ProfilerOverlay(active_window.scene, 0, 0)
+profiler_overlay.add(active_window.scene.persistent_sprites)
+startup_times.append(('main window', perf_counter()))
+first_frame = True
+if args.profile or args.profile_out:
+    profiler.toggle()
+recorder = None
+
+# Logic runs in fixed ticks; frames draw as often as FPS allows and blend
+# player positions between the last two ticks. A tick that has to catch up
+# inside a later frame is late; ticks beyond MAX_TICKS_PER_FRAME are dropped.
+accumulator = 0.
+ticks = late_ticks = dropped_ticks = 0
+previous_time = perf_counter()
 
 while running:
+    profiler.begin_frame()
+    now = perf_counter()
+    accumulator += now - previous_time
+    previous_time = now
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
         elif event.type == pygame.KEYDOWN:
             if event.key == pygame.K_r:
+                stop_recording(recorder)
                 active_window.restart()
+                recorder = start_recording(active_window)
+            elif event.key == pygame.K_F3:
+                profiler.toggle()
+        elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            active_window.scene.scheduler.wake_point(event.pos)
 
-    all_sprites.update()
-    screen.fill((32, 32, 32))
-    all_sprites.draw(screen)
-    pygame.display.flip()
+    profiler.mark('events')
 
-    active_window = active_window.next_window()
+    frame_ticks = 0
+    while accumulator >= TICK and frame_ticks < MAX_TICKS_PER_FRAME:
+        scene = active_window.scene
+        # Nothing plays, or is recorded, until a time-sliced level build is done.
+        loading = isinstance(active_window, LevelWindow) and active_window.loading
+        scene.input_state.set(InputState() if loading else read_keyboard())
+        if recorder is not None and not loading:
+            recorder.record(scene.input_state.value)
+        scene.scheduler.update()
+        accumulator -= TICK
+        frame_ticks += 1
 
+        next_window = active_window.next_window()
+        if next_window is not active_window:
+            active_window = next_window
+            profiler_overlay.kill()
+            profiler_overlay.scene = active_window.scene
+            profiler_overlay.add(active_window.scene.all_sprites, active_window.scene.hud_sprites,
+                                 active_window.scene.persistent_sprites)
+            active_window.scene.all_sprites.repaint_rect(screen.get_rect())
+            stop_recording(recorder)
+            recorder = start_recording(active_window)
+    if accumulator >= TICK:
+        dropped = int(accumulator // TICK)
+        accumulator -= dropped * TICK
+        dropped_ticks += dropped
+        profiler.count('dropped_ticks', dropped)
+    if frame_ticks > 1:
+        late_ticks += frame_ticks - 1
+        profiler.count('late_ticks', frame_ticks - 1)
+    ticks += frame_ticks
+    profiler.count('ticks', frame_ticks)
+    profiler_overlay.update()
+    profiler.mark('update')
+
+    alpha = accumulator / TICK
+    if DIRTY_RENDERING:
+        dirty_rects = active_window.draw(screen, alpha)
+        profiler.mark('draw')
+        pygame.display.update(dirty_rects)
+    else:
+        active_window.scene.all_sprites.repaint_rect(screen.get_rect())
+        active_window.draw(screen, alpha)
+        profiler.mark('draw')
+        pygame.display.flip()
+    profiler.mark('flip')
+    if capture is not None:
+        capture.capture(screen)
+        profiler.mark('capture')
+
+    if first_frame:
+        first_frame = False
+        startup_times.append(('first frame', perf_counter()))
+        if args.startup_profile:
+            print_startup_times(startup_times)
+        threading.Thread(target=prewarm, daemon=True).start()
+
+    profiler.end_frame()
     clock.tick(FPS)
+
+stop_recording(recorder)
+run_history.close()
+if capture is not None:
+    capture.close()
+    print(capture.report())
+if late_ticks or dropped_ticks:
+    print(f'{ticks} ticks: {late_ticks} late, {dropped_ticks} dropped')
+if args.profile_out:
+    profiler.export(args.profile_out)
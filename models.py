@@ -1,28 +1,21 @@
 from datetime import datetime
+from time import perf_counter
 from typing import Iterable
 
 import pygame
 from pygame.font import Font
-from pygame.sprite import Sprite
-
-from single_objects import (
-    all_sprites, wall_sprites,
-    player_sprites, button_sprites,
-    gate_sprites, win_sprites,
-    active_player_id, number_players,
-)
+from pygame.sprite import DirtySprite
+
+from single_objects import level_cache, profiler, run_history
+from scene import Scene
+from controls import InputState
+from fonts import get_font, render_text, glyph_atlas
+from images import tile_image, plain_background, BACKGROUND_COLOR
+from static_layer import StaticLayer
+from camera import Camera, ChunkedWorld
 from pg_utilities import (
-    normalize_vector, flatten,
-    read_bin_level_data,
-    button_color, player_color,
-)
-from pygame.locals import (
-    K_w, K_UP,
-    K_a, K_LEFT,
-    K_s, K_DOWN,
-    K_d, K_RIGHT,
-    K_LSHIFT, K_RSHIFT,
-    K_TAB
+    normalize_vector,
+    PLAYER_COLORS,
 )
 
 
@@ -35,115 +28,101 @@ from pygame.locals import (
 # 0x30..0x3F | AND Gates | +
 # 0xF0..0xF7 | Players   | +
 
-class Wall(Sprite):
-    def __init__(self, x, y, size=64, fill_color="white"):
-        super().__init__(all_sprites)
-        self.add(wall_sprites)
-        self.image = pygame.Surface((size, size),
-                                    pygame.SRCALPHA, 32)
-        pygame.draw.rect(self.image, fill_color,
-                         (0, 0, size, size))
+class Wall(DirtySprite):
+    _layer = 1
+
+    def __init__(self, scene, x, y, size=64, fill_color="white"):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.image = tile_image('wall', fill_color, size=size)
         self.rect = pygame.Rect(x, y, size, size)
+        self.scene.collision_grid.add(self)
 
 
-class Gate(Sprite):
-    def __init__(self, x, y, size=64, gate_id=0, type_or=True):
-        super().__init__(all_sprites)
-        self.add(gate_sprites)
+class Gate(DirtySprite):
+    def __init__(self, scene, x, y, size=64, gate_id=0, type_or=True):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.gate_sprites)
 
         self.gate_id = gate_id
         self.size = size
         self.type_or = type_or
         self.active = False
+        self.rect = pygame.Rect(x, y, size, size)
         self.disable()
-
-        self.image = pygame.Surface((size, size),
-                                    pygame.SRCALPHA, 32)
+        self.scene.logic_circuit.add_gate(self)
         self.image_update()
-        self.rect = pygame.Rect(x, y, size, size)
 
     def disable(self):
-        self.add(wall_sprites)
+        self.scene.collision_grid.add(self)
         self.active = False
 
     def enable(self):
-        wall_sprites.remove(self)
+        self.scene.collision_grid.remove(self)
         self.active = True
 
-    def logic_update(self):
-        active = (all, any)[self.type_or](map(lambda button: button.active,
-                                              filter(lambda button: button.button_id == self.gate_id, button_sprites)))
+    def logic_update(self, active):
         if self.active != active:
             if active:
                 self.enable()
             else:
                 self.disable()
-        self.image_update()
+            self.image_update()
 
     def image_update(self):
-        self.image.fill(pygame.SRCALPHA)
-        pygame.draw.rect(self.image, button_color(self.gate_id, self.active is False),
-                         (0, 0, self.size, self.size), self.size // 8)
-        if self.active:
-            pygame.draw.rect(self.image, pygame.SRCALPHA,
-                             (self.size // 4, 0, self.size // 8, self.size), self.size // 8)
-            pygame.draw.rect(self.image, pygame.SRCALPHA,
-                             (self.size * 0.625, 0, self.size // 8, self.size), self.size // 8)
-            pygame.draw.rect(self.image, pygame.SRCALPHA,
-                             (0, self.size // 4, self.size, self.size // 8), self.size // 8)
-            pygame.draw.rect(self.image, pygame.SRCALPHA,
-                             (0, self.size * 0.625, self.size, self.size // 8), self.size // 8)
-        if not self.type_or:
-            pygame.draw.rect(self.image, button_color(self.gate_id, self.active is False),
-                             (self.size // 4, self.size // 4, self.size // 2, self.size // 2), self.size // 8)
-
-
-class Button(Sprite):
-    def __init__(self, x, y, size=32, button_id=0):
-        super().__init__(all_sprites)
-        self.add(button_sprites)
+        profiler.count('image_update')
+        self.image = tile_image(('and_gate', 'or_gate')[self.type_or], self.gate_id, self.active, self.size)
+        self.dirty = 1
+
+
+class Button(DirtySprite):
+    _layer = 3
+
+    def __init__(self, scene, x, y, size=32, button_id=0):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.button_sprites)
 
         self.button_id = button_id
         self.size = size
         self.active = False
 
-        self.image = pygame.Surface((size, size),
-                                    pygame.SRCALPHA, 32)
         self.image_update()
         self.rect = pygame.Rect(x, y, size, size)
+        self.entity_index = self.scene.entity_store.add_button(self.rect)
+        self.scene.logic_circuit.add_button(self)
+        self.scene.scheduler.add_sensor(self)
 
     def update(self):
         self.collide()
 
     def image_update(self):
-        self.image.fill(pygame.SRCALPHA)
-        pygame.draw.rect(self.image, button_color(self.button_id, self.active),
-                         (0, 0, self.size, self.size), self.size // 4)
+        profiler.count('image_update')
+        self.image = tile_image('button', self.button_id, self.active, self.size)
+        self.dirty = 1
 
     def collide(self):
-        active = self.active
-        if pygame.sprite.spritecollideany(self, player_sprites):
-            self.active = True
-            self.image_update()
-        else:
-            self.active = False
-            self.image_update()
+        active = self.scene.entity_store.players_on_button(self.entity_index) > 0
         if active != self.active:
-            for gate in gate_sprites:
-                gate.logic_update()
+            self.active = active
+            self.image_update()
+            self.scene.logic_circuit.set_button(self.button_id, self.active)
 
 
-class Win(Sprite):
-    def __init__(self, x, y, size=80, type_and=True, font: Font = None, win_callbacks: Iterable = None):
-        super().__init__(all_sprites)
-        self.add(win_sprites)
+class Win(DirtySprite):
+    def __init__(self, scene, x, y, size=80, type_and=True, font: Font = None, win_callbacks: Iterable = None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.win_sprites)
 
         if win_callbacks is None:
             win_callbacks = []
         self.win_callbacks = win_callbacks
 
         if font is None:
-            self.font = Font('data/fonts/BrassMono-Regular.ttf', size // 2)
+            font = get_font(size // 2)
+        self.font = font
 
         self.type_and = type_and
         self.size = size
@@ -155,122 +134,166 @@ class Win(Sprite):
                                     pygame.SRCALPHA, 32)
         self.image_update()
         self.rect = pygame.Rect(x, y, size, size)
+        self.entity_index = self.scene.entity_store.add_win(self.rect)
+        self.scene.scheduler.add_sensor(self)
 
     def update(self):
         self.collide()
 
     def image_update(self):
+        profiler.count('image_update')
         self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
         pygame.draw.rect(self.image, self.color,
                          (0, 0, self.size, self.size))
 
-        text_surface = self.font.render(f'{self.players}/{int(number_players)}', True, (32, 32, 32))
-        self.image.blit(text_surface, ((self.size - text_surface.get_size()[0]) // 2,
-                                       (self.size - text_surface.get_size()[1]) // 1.75))
+        text = f'{self.players}/{int(self.scene.number_players)}'
+        atlas = glyph_atlas(self.font, (32, 32, 32))
+        text_width, text_height = atlas.size(text)
+        atlas.blit(self.image, text, ((self.size - text_width) // 2,
+                                      (self.size - text_height) // 1.75))
 
     def win(self):
         for callback in self.win_callbacks:
             callback()
 
     def collide(self):
-        players = sum(map(lambda player: self.rect.colliderect(player.rect), player_sprites))
+        players = self.scene.entity_store.players_on_win(self.entity_index)
         if players != self.players:
             self.players = players
             self.image_update()
-            if self.type_and and self.players == int(number_players):
+            if self.type_and and self.players == int(self.scene.number_players):
                 self.win()
             elif not self.type_and and self.players > 0:
                 self.win()
 
 
-class Player(Sprite):
-    def __init__(self, x, y, size=48, player_id=0, base_speed=6):
-        super().__init__(all_sprites)
-        self.add(player_sprites)
+class Player(DirtySprite):
+    _layer = 2
+
+    def __init__(self, scene, x, y, size=48, player_id=0, base_speed=6):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.player_sprites)
 
         self.player_id = player_id
 
         self.base_speed = base_speed
         self.speed = base_speed
 
-        self.image = pygame.Surface((size, size),
-                                    pygame.SRCALPHA, 32)
-        pygame.draw.rect(self.image, player_color(player_id),
-                         (0, 0, size, size))
+        self.image = tile_image('player', player_id, size=size)
         self.rect = pygame.Rect(x, y, size, size)
+        self.previous_position = self.position = self.drawn_position = self.rect.topleft
+        self.entity_index = self.scene.entity_store.add_player(self.rect)
+        self.scene.scheduler.add(self)
 
     def update(self):
-        if int(active_player_id) == self.player_id:
-            vx, vy = self.get_input_vectors()
-            if self.is_shift_pressed():
-                self.speed = self.base_speed * 2
-            else:
-                self.speed = self.base_speed
-            self.move_and_collide(vx, vy)
+        self.previous_position = self.rect.topleft
+        keys = self.get_inputs()
+        if keys is not None:
+            self.control(keys)
+
+    def get_inputs(self):
+        # In co-op every player has its own inputs, otherwise only the
+        # active player follows the keyboard.
+        if self.scene.player_inputs is not None:
+            return self.scene.player_inputs.get(self.player_id)
+        if int(self.scene.active_player_id) == self.player_id:
+            return self.scene.input_state.value
+        return None
+
+    def control(self, keys: InputState):
+        vx, vy = self.get_input_vectors(keys)
+        if self.is_shift_pressed(keys):
+            self.speed = self.base_speed * 2
+        else:
+            self.speed = self.base_speed
+        position = self.rect.copy()
+        self.move_and_collide(vx, vy)
+        if self.rect.topleft != position.topleft:
+            self.dirty = 1
+            self.scene.entity_store.move_player(self.entity_index, self.rect)
+            self.scene.scheduler.wake_area(position.union(self.rect))
 
     @staticmethod
-    def is_shift_pressed():
-        keys = pygame.key.get_pressed()
-        return keys[K_LSHIFT] or keys[K_RSHIFT]
+    def is_shift_pressed(keys: InputState):
+        return keys.shift
 
     @staticmethod
-    def get_input_vectors():
-        keys = pygame.key.get_pressed()
+    def get_input_vectors(keys: InputState):
         vx, vy = 0, 0
-        if keys[K_w] or keys[K_UP]:
+        if keys.up:
             vy += -1
-        if keys[K_a] or keys[K_LEFT]:
+        if keys.left:
             vx += -1
-        if keys[K_s] or keys[K_DOWN]:
+        if keys.down:
             vy += 1
-        if keys[K_d] or keys[K_RIGHT]:
+        if keys.right:
             vx += 1
         return normalize_vector((vx, vy))
 
-    def move(self, vx, vy, speed=None):
+    def interpolate(self, alpha):
+        # Shows the player between its last two tick positions until settle().
+        x, y = self.previous_position
+        self.position = self.rect.topleft
+        position = round(x + (self.rect.x - x) * alpha), round(y + (self.rect.y - y) * alpha)
+        if position != self.drawn_position:
+            self.drawn_position = position
+            self.dirty = 1
+        self.rect.topleft = position
+
+    def settle(self):
+        self.rect.topleft = self.position
+
+    def step(self, vx, vy, speed=None):
         if speed is None:
             speed = self.speed
-        self.rect.x = self.rect.x + vx * speed
-        self.rect.y = self.rect.y + vy * speed
+        target = self.rect.copy()
+        target.x = self.rect.x + vx * speed
+        target.y = self.rect.y + vy * speed
+        return target.x - self.rect.x, target.y - self.rect.y
 
     def move_and_collide(self, vx, vy):
         fx, fy = True, True
 
-        if pygame.sprite.spritecollideany(self, wall_sprites):
+        if self.scene.collision_grid.collideany(self.rect):
             return False
 
-        if pygame.sprite.spritecollideany(self,
-                                          filter(lambda x: int(active_player_id) != x.player_id, player_sprites)):
+        if self.scene.entity_store.touches_player(self.entity_index):
             self.speed *= 0.5
 
         if vx:
-            self.move(vx, 0)
-            if pygame.sprite.spritecollideany(self, wall_sprites):
-                fx = False
-                while pygame.sprite.spritecollideany(self, wall_sprites):
-                    self.move(-vx, 0, speed=1)
+            dx = self.step(vx, 0)[0]
+            allowed = self.scene.collision_grid.sweep(self.rect, dx=dx)[0]
+            self.rect.x += allowed
+            fx = allowed == dx
         if vy:
-            self.move(0, vy)
-            if pygame.sprite.spritecollideany(self, wall_sprites):
-                fy = False
-                while pygame.sprite.spritecollideany(self, wall_sprites):
-                    self.move(0, -vy, speed=1)
+            dy = self.step(0, vy)[1]
+            allowed = self.scene.collision_grid.sweep(self.rect, dy=dy)[1]
+            self.rect.y += allowed
+            fy = allowed == dy
 
         return fx or fy
 
 
-class GameTimer(Sprite):
-    def __init__(self, x, y, size=64, font: Font = None):
-        super().__init__(all_sprites)
+class GameTimer(DirtySprite):
+    _layer = 4
+
+    def __init__(self, scene, x, y, size=64, font: Font = None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.hud_sprites)
         self.size = size
         self.start_time = datetime.now()
 
         if font is None:
-            self.font = Font('data/fonts/BrassMono-Regular.ttf', size // 2)
+            font = get_font(size // 2)
+        self.font = font
 
         self.image = pygame.Surface((size * 10, size),
                                     pygame.SRCALPHA, 32)
         self.rect = pygame.Rect(x, y, size * 10, size)
+        self.scene.scheduler.add(self)
 
     def update(self):
         self.image_update()
@@ -279,22 +302,27 @@ class GameTimer(Sprite):
         return datetime.now() - self.start_time
 
     def image_update(self):
+        profiler.count('image_update')
         color = "white"
         self.image.fill(pygame.SRCALPHA)
-        text_surface = self.font.render(f'{self.get_time().total_seconds():.2f} seconds', True,
-                                        color)
+        self.dirty = 1
+        atlas = glyph_atlas(self.font, color)
+        atlas.blit(self.image, f'{self.get_time().total_seconds():.2f} seconds',
+                   (self.size * 0.25, (self.size - atlas.height) // 1.75))
 
-        self.image.blit(text_surface, (self.size * 0.25,
-                                       (self.size - text_surface.get_size()[1]) // 1.75))
 
+class CurrentPlayer(DirtySprite):
+    _layer = 4
 
-class CurrentPlayer(Sprite):
-    def __init__(self, x, y, size=64, font: Font = None):
-        super().__init__(all_sprites)
+    def __init__(self, scene, x, y, size=64, font: Font = None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.hud_sprites)
         self.size = size
 
         if font is None:
-            self.font = Font('data/fonts/BrassMono-Regular.ttf', size // 2)
+            font = get_font(size // 2)
+        self.font = font
 
         self.last_active_player = None
         self.tab_pressed = False
@@ -302,45 +330,50 @@ class CurrentPlayer(Sprite):
         self.image = pygame.Surface((size * 10, size),
                                     pygame.SRCALPHA, 32)
         self.rect = pygame.Rect(x, y, size * 10, size)
+        self.scene.scheduler.add(self)
 
     def is_tab_down(self):
-        keys = pygame.key.get_pressed()
+        tab = self.scene.input_state.value.tab
         if self.tab_pressed:
-            self.tab_pressed = keys[K_TAB]
+            self.tab_pressed = tab
             return False
         else:
-            self.tab_pressed = keys[K_TAB]
-            return keys[K_TAB]
+            self.tab_pressed = tab
+            return tab
 
     def update(self):
-        if int(active_player_id) != self.last_active_player:
-            self.last_active_player = int(active_player_id)
+        if int(self.scene.active_player_id) != self.last_active_player:
+            self.last_active_player = int(self.scene.active_player_id)
             self.image_update()
         if self.is_tab_down():
-            active_player_id.set((int(active_player_id) + 1) % int(number_players))
+            self.scene.active_player_id.set((int(self.scene.active_player_id) + 1) % int(self.scene.number_players))
 
     def image_update(self):
-        color = player_color(self.last_active_player)
+        profiler.count('image_update')
+        color = PLAYER_COLORS[self.last_active_player]
         self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
         pygame.draw.rect(self.image, color,
                          (0, 0, self.size * 4, self.size), 8)
-        text_surface = self.font.render(f'Player {self.last_active_player + 1}/{int(number_players)}', True, color)
+        text = f'Player {self.last_active_player + 1}/{int(self.scene.number_players)}'
+        text_surface = render_text(self.font, text, color)
         self.image.blit(text_surface, ((self.size * 4 - text_surface.get_size()[0]) // 2,
                                        (self.size - text_surface.get_size()[1]) // 1.75))
 
-        text_surface = self.font.render('Use TAB to switch', True, color)
+        text_surface = render_text(self.font, 'Use TAB to switch', color)
         self.image.blit(text_surface, (self.size * 4.5,
                                        (self.size - text_surface.get_size()[1]) // 1.75))
 
 
-class StatisticSprite(Sprite):
-    def __init__(self, x, y, size=64, font: Font = None, **statistics):
-        super().__init__(all_sprites)
+class StatisticSprite(DirtySprite):
+    def __init__(self, scene, x, y, size=64, font: Font = None, **statistics):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
         self.size = size
         self.statistics = statistics
 
         if font is None:
-            font = Font('data/fonts/BrassMono-Regular.ttf', size // 2)
+            font = get_font(size // 2)
         self.font = font
 
         self.image = pygame.Surface((size * 10, size * 10),
@@ -349,8 +382,10 @@ class StatisticSprite(Sprite):
         self.image_update()
 
     def image_update(self):
+        profiler.count('image_update')
         color = (255, 255, 255)
         self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
         pygame.draw.rect(self.image, (*color, 10),
                          (0, 0, self.size * 10, self.size * 10), )
         pygame.draw.rect(self.image, color,
@@ -358,18 +393,124 @@ class StatisticSprite(Sprite):
         text = "\n".join(map(lambda item: f"{item[0]} - {item[1]}", self.statistics.items()))
 
         for i, line in enumerate(text.split("\n"), start=3):
-            text_surface = self.font.render(line, True, color)
+            text_surface = render_text(self.font, line, color)
             self.image.blit(text_surface, ((self.size * 10 - text_surface.get_size()[0]) // 2,
                                            (self.size * (i + 1) - text_surface.get_size()[1]) // 1.75))
 
-        text_surface = self.font.render('You have won!', True, (100, 255, 100))
+        text_surface = render_text(self.font, 'You have won!', (100, 255, 100))
         self.image.blit(text_surface, ((self.size * 10 - text_surface.get_size()[0]) // 2,
                                        (self.size * 2 - text_surface.get_size()[1]) // 1.75))
 
 
-class TextButton(Sprite):
-    def __init__(self, x, y, text, size=64, font: Font = None, callbacks=None):
-        super().__init__(all_sprites)
+class ProfilerOverlay(DirtySprite):
+    _layer = 5
+
+    def __init__(self, scene, x, y, size=24, frames=120, refresh=15, font: Font = None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.hud_sprites)
+        self.size = size
+        self.frames = frames
+        self.refresh = refresh
+        self.ticks = 0
+
+        if font is None:
+            font = get_font(size * 3 // 4)
+        self.font = font
+
+        self.image = pygame.Surface((size * 16, size * 10),
+                                    pygame.SRCALPHA, 32)
+        self.rect = pygame.Rect(x, y, size * 16, size * 10)
+        self.visible = 0
+
+    def update(self):
+        if self.visible != profiler.enabled:
+            self.visible = int(profiler.enabled)
+            self.image_update()
+        elif self.visible:
+            self.ticks += 1
+            if self.ticks % self.refresh == 0:
+                self.image_update()
+
+    def lines(self):
+        frames = list(profiler.frames)[-self.frames:]
+        frame_times = sorted(frame['frame'] for frame in frames)
+        if not frame_times:
+            return ['Profiling...']
+        mean = sum(frame_times) / len(frame_times)
+        lines = [f'{1000 / mean:.0f} fps  {mean:.2f} ms',
+                 f'p50 {frame_times[len(frame_times) // 2]:.2f}  p99 {frame_times[-1 - len(frame_times) // 100]:.2f}']
+        totals = {}
+        for frame in frames:
+            for name, value in frame.items():
+                if name != 'frame':
+                    totals[name] = totals.get(name, 0) + value
+        for name, value in sorted(totals.items(), key=lambda item: -item[1])[:7]:
+            lines.append(f'{name}: {value / len(frames):.2f}')
+        return lines
+
+    def image_update(self):
+        profiler.count('image_update')
+        color = (255, 255, 100)
+        self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
+        if not self.visible:
+            return
+        pygame.draw.rect(self.image, (0, 0, 0, 160), self.image.get_rect())
+        for i, line in enumerate(self.lines()):
+            self.image.blit(render_text(self.font, line, color), (self.size // 2, self.size // 4 + i * self.size))
+
+
+class LoadingBar(DirtySprite):
+    _layer = 4
+
+    def __init__(self, scene, x, y, builder, total, size=64, budget=0.004, font: Font = None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
+        self.add(scene.hud_sprites)
+        self.size = size
+        self.builder = builder
+        self.total = total
+        self.budget = budget
+        self.built = 0
+
+        if font is None:
+            font = get_font(size // 2)
+        self.font = font
+
+        self.image = pygame.Surface((size * 8, size),
+                                    pygame.SRCALPHA, 32)
+        self.rect = pygame.Rect(x, y, size * 8, size)
+        self.image_update()
+        scene.scheduler.add(self)
+
+    def update(self):
+        deadline = perf_counter() + self.budget
+        for self.built in self.builder:
+            if perf_counter() >= deadline:
+                self.image_update()
+                return
+        self.kill()
+
+    def image_update(self):
+        profiler.count('image_update')
+        color = (255, 255, 255)
+        self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
+        progress = self.built / self.total if self.total else 1
+        pygame.draw.rect(self.image, (*color, 50),
+                         (0, 0, self.size * 8 * progress, self.size))
+        pygame.draw.rect(self.image, color,
+                         (0, 0, self.size * 8, self.size), 8)
+        text_surface = render_text(self.font, f'Loading {progress:.0%}', color)
+        self.image.blit(text_surface, ((self.size * 8 - text_surface.get_size()[0]) // 2,
+                                       (self.size - text_surface.get_size()[1]) // 1.75))
+
+
+class TextButton(DirtySprite):
+    def __init__(self, scene, x, y, text, size=64, font: Font = None, callbacks=None):
+        super().__init__(scene.all_sprites)
+        self.scene = scene
         self.size = size
         self.text = text
 
@@ -378,13 +519,15 @@ class TextButton(Sprite):
         self.callbacks = callbacks
 
         if font is None:
-            font = Font('data/fonts/BrassMono-Regular.ttf', size // 2)
+            font = get_font(size // 2)
         self.font = font
 
         self.image = pygame.Surface((size * 6, size * 2),
                                     pygame.SRCALPHA, 32)
         self.rect = pygame.Rect(x, y, size * 6, size * 2)
+        self.clicked = False
         self.image_update()
+        self.scene.scheduler.add_pointer(self)
 
     def pressed(self):
         for callback in self.callbacks:
@@ -394,68 +537,100 @@ class TextButton(Sprite):
         self.get_input()
 
     def get_input(self):
-        mouse_buttons = pygame.mouse.get_pressed()
-        if mouse_buttons[0]:
-            mouse_pos = pygame.mouse.get_pos()
-            if self.rect.collidepoint(mouse_pos):
-                self.pressed()
+        if self.clicked:
+            self.clicked = False
+            self.pressed()
 
     def image_update(self):
+        profiler.count('image_update')
         color = (100, 240, 100)
         self.image.fill(pygame.SRCALPHA)
+        self.dirty = 1
         pygame.draw.rect(self.image, (*color, 50),
                          (0, 0, self.size * 6, self.size * 2))
         pygame.draw.rect(self.image, color,
                          (0, 0, self.size * 6, self.size * 2), 8)
 
-        text_surface = self.font.render(self.text, True, color)
+        text_surface = render_text(self.font, self.text, color)
         self.image.blit(text_surface, ((self.size * 6 - text_surface.get_size()[0]) // 2,
                                        (self.size * 2 - text_surface.get_size()[1]) // 2))
 
 
+BUILD_BUDGET = 0.004
+
+LEVELS = (
+    ("Level 1", "data/levels/test_level.bin"),
+    ("Level 2", "data/levels/level2.bin"),
+    ("Level 3", "data/levels/level3.bin"),
+    ("Level 4", "data/levels/level4.bin"),
+)
+
+
+def prewarm_assets(dot_size=64, window_width=800, window_height=800):
+    # Builds the fonts, tiles and levels the menu leads to, so that opening
+    # the first level doesn't pay for them. Meant to run in a background thread.
+    get_font(dot_size // 2)
+    get_font(int(dot_size * 1.25) // 2)
+    tile_image('wall', 'white', size=dot_size)
+    for tile_id in range(16):
+        for active in (False, True):
+            tile_image('or_gate', tile_id, active, dot_size)
+            tile_image('and_gate', tile_id, active, dot_size)
+            tile_image('button', tile_id, active, int(dot_size * 0.50))
+    for player_id in range(8):
+        tile_image('player', player_id, size=int(dot_size * 0.75))
+    level_cache.load_all([path for _, path in LEVELS], dot_size, window_width, window_height)
+
+
+def record_run(path, players, time_ms):
+    previous = run_history.best(path, players)
+    run_history.add(path, players, time_ms)
+    best_ms, _ = run_history.best(path, players)
+    new = ' (new!)' if previous is not None and time_ms < previous[0] else ''
+    return {'best': f'{best_ms / 1000:.2f}s{new}',
+            'median': f'{run_history.median(path, players) / 1000:.2f}s',
+            'runs': run_history.runs(path, players)}
+
+
 class MainWindow:
-    def __init__(self, dot_size=64, window_width=None, window_height=None):
+    def __init__(self, dot_size=64, window_width=None, window_height=None, scene: Scene = None, prefetch=True):
+        self.scene = Scene() if scene is None else scene
         self.switch_window = None
         self.sprites = []
         self.dot_size = dot_size
         self.window_width = window_width
         self.window_height = window_height
+        self.background = plain_background(window_width, window_height)
 
         self.width_indent = (window_width - dot_size * 10) // 2
         self.height_indent = (window_height - dot_size * 10) // 2
 
+        if prefetch:
+            level_cache.prefetch([path for _, path in LEVELS], self.dot_size, window_width, window_height)
         self.load_sprites()
 
     def load_sprites(self):
-        self.sprites.append(TextButton(self.width_indent + self.dot_size * (-2),
-                                       self.height_indent + self.dot_size * 0, "Level 1",
-                                       callbacks=(lambda: self.switch("data/levels/test_level.bin"),)))
-        self.sprites.append(TextButton(self.width_indent + self.dot_size * 6,
-                                       self.height_indent + self.dot_size * 0, "Level 2",
-                                       callbacks=(lambda: self.switch("data/levels/level2.bin"),)))
-        self.sprites.append(TextButton(self.width_indent + self.dot_size * (-2),
-                                       self.height_indent + self.dot_size * 3, "Level 3",
-                                       callbacks=(lambda: self.switch("data/levels/level3.bin"),)))
-        self.sprites.append(TextButton(self.width_indent + self.dot_size * 6,
-                                       self.height_indent + self.dot_size * 3, "Level 4",
-                                       callbacks=(lambda: self.switch("data/levels/level4.bin"),)))
+        for i, (text, path) in enumerate(LEVELS):
+            self.sprites.append(TextButton(self.scene, self.width_indent + self.dot_size * (i % 2 * 8 - 2),
+                                           self.height_indent + self.dot_size * (i // 2 * 3), text,
+                                           callbacks=(lambda level_path=path: self.switch(level_path),)))
 
     def switch(self, path):
         self.switch_window = LevelWindow(path,
                                          window_width=self.window_width, window_height=self.window_height,
-                                         dot_size=64)
-
-    def __del__(self):
-        self.kill_sprites()
+                                         dot_size=64, build_budget=BUILD_BUDGET)
 
     def kill_sprites(self):
-        for sprite in self.sprites:
-            sprite.kill()
+        self.sprites.clear()
+        self.scene.clear()
 
     def restart(self):
         self.kill_sprites()
         self.load_sprites()
 
+    def draw(self, screen, alpha=1.):
+        return self.scene.all_sprites.draw(screen, self.background)
+
     def next_window(self):
         if self.switch_window is not None:
             next_wind = self.switch_window
@@ -465,12 +640,14 @@ class MainWindow:
 
 
 class StatisticsWindow:
-    def __init__(self, dot_size=64, window_width=None, window_height=None, **statistics):
+    def __init__(self, dot_size=64, window_width=None, window_height=None, scene: Scene = None, **statistics):
+        self.scene = Scene() if scene is None else scene
         self.switch_window = False
         self.sprites = []
         self.dot_size = dot_size
         self.window_width = window_width
         self.window_height = window_height
+        self.background = plain_background(window_width, window_height)
         self.statistics = statistics
 
         self.width_indent = (window_width - dot_size * 10) // 2
@@ -479,26 +656,26 @@ class StatisticsWindow:
         self.load_sprites()
 
     def load_sprites(self):
-        self.sprites.append(StatisticSprite(self.width_indent, self.height_indent,
+        self.sprites.append(StatisticSprite(self.scene, self.width_indent, self.height_indent,
                                             self.dot_size, **self.statistics))
-        self.sprites.append(TextButton(self.width_indent + self.dot_size * 2,
+        self.sprites.append(TextButton(self.scene, self.width_indent + self.dot_size * 2,
                                        self.height_indent + self.dot_size * 7, "Back to main menu",
                                        callbacks=(self.button_pressed,)))
 
     def button_pressed(self):
         self.switch_window = True
 
-    def __del__(self):
-        self.kill_sprites()
-
     def kill_sprites(self):
-        for sprite in self.sprites:
-            sprite.kill()
+        self.sprites.clear()
+        self.scene.clear()
 
     def restart(self):
         self.kill_sprites()
         self.load_sprites()
 
+    def draw(self, screen, alpha=1.):
+        return self.scene.all_sprites.draw(screen, self.background)
+
     def next_window(self):
         if self.switch_window:
             next_wind = MainWindow(window_width=self.window_width, window_height=self.window_height,
@@ -509,8 +686,13 @@ class StatisticsWindow:
 
 
 class LevelWindow:
-    def __init__(self, path, dot_size=64, window_width=800, window_height=800):
-        self.level = read_bin_level_data(path)
+    def __init__(self, path, dot_size=64, window_width=800, window_height=800, static_walls=True,
+                 headless=False, camera=None, scene: Scene = None, build_budget=None):
+        self.scene = Scene() if scene is None else scene
+        cached = level_cache.get(path, dot_size, window_width, window_height, static_walls and not headless)
+        self.level = cached.level
+        self.buckets = cached.buckets
+        self.build_budget = build_budget
         self.path = path
         self.level_width, self.level_height = len(self.level[0]), len(self.level)
         self.sprites = []
@@ -518,13 +700,31 @@ class LevelWindow:
         self.window_width = window_width
         self.window_height = window_height
         self.switch_window = None
+        self.static_walls = static_walls
+        self.headless = headless
+        self.static_layer: StaticLayer = cached.static_layer
+        self.background = cached.background
+        if self.background is None:
+            self.background = plain_background(window_width, window_height)
 
         self.game_timer: GameTimer = None
 
         self.width_indent = (window_width - self.level_width * self.dot_size) // 2
         self.height_indent = (window_height - self.level_height * self.dot_size) // 2
 
-        number_players.set(len(set(filter(lambda dt: 0xF0 <= dt <= 0xF7, flatten(self.level)))))
+        level_rect = pygame.Rect(self.width_indent, self.height_indent,
+                                 self.level_width * self.dot_size, self.level_height * self.dot_size)
+        if camera is None:
+            camera = not pygame.Rect(0, 0, window_width, window_height).contains(level_rect)
+        self.camera = None
+        self.world = None
+        if camera and not headless:
+            self.camera = Camera(window_width, window_height, level_rect)
+            self.world = ChunkedWorld(self.scene.all_sprites,
+                                      self.static_layer.chunk_size if self.static_layer else 16 * self.dot_size,
+                                      self.width_indent, self.height_indent)
+
+        self.scene.number_players.set(cached.number_players)
         self.load_sprites()
 
     def win(self):
@@ -532,59 +732,129 @@ class LevelWindow:
 
     def next_window(self):
         if self.switch_window:
+            time_ms = round(self.game_timer.get_time().total_seconds() * 1000)
+            players = int(self.scene.number_players)
             next_wind = StatisticsWindow(window_width=self.window_width, window_height=self.window_height,
-                                         dot_size=64, lvl=self.path,
-                                         time=f'{self.game_timer.get_time().total_seconds():.2f}s')
+                                         dot_size=64, lvl=self.path, time=f'{time_ms / 1000:.2f}s',
+                                         **record_run(self.path, players, time_ms))
             self.kill_sprites()
             return next_wind
         return self
 
+    def active_player(self):
+        for player in self.scene.player_sprites:
+            if player.player_id == int(self.scene.active_player_id):
+                return player
+        return None
+
+    def update_camera(self):
+        player = self.active_player()
+        if player is not None:
+            self.camera.follow(player.rect)
+        self.world.activate(self.camera.view)
+        if self.static_layer is not None:
+            self.static_layer.release(self.world.active)
+
+    def draw(self, screen, alpha=1.):
+        for player in self.scene.player_sprites:
+            player.interpolate(alpha)
+        try:
+            return self.draw_sprites(screen)
+        finally:
+            for player in self.scene.player_sprites:
+                player.settle()
+
+    def draw_sprites(self, screen):
+        if self.camera is None:
+            return self.scene.all_sprites.draw(screen, self.background)
+        self.update_camera()
+        screen.fill(BACKGROUND_COLOR)
+        if self.static_layer is not None:
+            self.static_layer.blit(screen, self.camera.offset)
+        offset_x, offset_y = self.camera.offset
+        for sprite in self.scene.all_sprites.sprites():
+            if self.scene.hud_sprites.has(sprite):
+                screen.blit(sprite.image, sprite.rect)
+            else:
+                screen.blit(sprite.image, sprite.rect.move(-offset_x, -offset_y))
+        return [screen.get_rect()]
+
     def load_sprites(self):
-        for priority in range(4):
-            for y, line in enumerate(self.level):
-                for x, dot in enumerate(line):
-                    match dot:
-                        case 0x01 if priority == 1:
-                            self.sprites.append(
-                                Wall(self.width_indent + self.dot_size * x, self.height_indent + self.dot_size * y,
-                                     size=self.dot_size))
-                        case _ if 0x10 <= dot <= 0x1F and priority == 3:
-                            self.sprites.append(
-                                Button(self.width_indent + self.dot_size * 0.50 // 2 + self.dot_size * x,
-                                       self.height_indent + self.dot_size * 0.50 // 2 + self.dot_size * y,
-                                       size=int(self.dot_size * 0.50), button_id=dot - 0x10))
-                        case _ if 0x20 <= dot <= 0x2F and priority == 0:
-                            self.sprites.append(
-                                Gate(self.width_indent + self.dot_size * x,
-                                     self.height_indent + self.dot_size * y,
-                                     size=int(self.dot_size), gate_id=dot - 0x20, type_or=True))
-                        case _ if 0x30 <= dot <= 0x3F and priority == 0:
-                            self.sprites.append(
-                                Gate(self.width_indent + self.dot_size * x,
-                                     self.height_indent + self.dot_size * y,
-                                     size=int(self.dot_size), gate_id=dot - 0x30, type_or=False))
-                        case _ if 0xF0 <= dot <= 0xF7 and priority == 2:
-                            self.sprites.append(
-                                Player(self.width_indent + self.dot_size * 0.25 // 2 + self.dot_size * x,
-                                       self.height_indent + self.dot_size * 0.25 // 2 + self.dot_size * y,
-                                       size=int(self.dot_size * 0.75), player_id=dot - 0xF0,
-                                       base_speed=self.dot_size // 10))
-                        case 0x03 if priority == 0:
-                            self.sprites.append(
-                                Win(self.width_indent - self.dot_size * 0.25 // 2 + self.dot_size * x,
-                                    self.height_indent - self.dot_size * 0.25 // 2 + self.dot_size * y,
-                                    size=int(self.dot_size * 1.25), win_callbacks=(self.win,)))
-
-        self.sprites.append(CurrentPlayer(self.dot_size // 2, self.dot_size // 2, self.dot_size))
-        self.game_timer = GameTimer(self.dot_size // 2, self.window_height - self.dot_size * 1.5, self.dot_size)
-
-    def __del__(self):
-        self.kill_sprites()
+        self.scene.collision_grid.reset(self.level_width, self.level_height, self.dot_size,
+                                        self.width_indent, self.height_indent)
+        self.scene.logic_circuit.reset()
+        self.scene.entity_store.reset()
+        self.scene.scheduler.reset(self.dot_size)
+        # Players are built over several ticks and miss the update of the tick
+        # they are built in, so ticks before the build finishes are not played.
+        self.loading = self.build_budget is not None
+        if self.build_budget is None:
+            for _ in self.build_sprites():
+                pass
+        else:
+            LoadingBar(self.scene, (self.window_width - self.dot_size * 8) // 2,
+                       (self.window_height - self.dot_size) // 2, self.build_sprites(),
+                       sum(map(len, self.buckets)), self.dot_size, self.build_budget)
+
+    def build_sprites(self):
+        # Yields the number of tiles built so far, so the caller can spread
+        # the work over several frames.
+        built = 0
+        for bucket in self.buckets:
+            for x, y, dot in bucket:
+                sprite = self.create_sprite(x, y, dot)
+                if sprite is not None:
+                    self.sprites.append(sprite)
+                built += 1
+                yield built
+
+        if self.world is not None:
+            self.world.clear()
+            for sprite in self.sprites:
+                if not self.scene.player_sprites.has(sprite):
+                    self.world.add(sprite)
+            self.update_camera()
+
+        self.sprites.append(CurrentPlayer(self.scene, self.dot_size // 2, self.dot_size // 2, self.dot_size))
+        if not self.headless:
+            self.game_timer = GameTimer(self.scene, self.dot_size // 2, self.window_height - self.dot_size * 1.5,
+                                        self.dot_size)
+        self.loading = False
+
+    def create_sprite(self, x, y, dot):
+        match dot:
+            case 0x01 if self.static_walls:
+                self.scene.collision_grid.add_solid(x, y)
+            case 0x01:
+                return Wall(self.scene, self.width_indent + self.dot_size * x,
+                            self.height_indent + self.dot_size * y, size=self.dot_size)
+            case _ if 0x10 <= dot <= 0x1F:
+                return Button(self.scene, self.width_indent + self.dot_size * 0.50 // 2 + self.dot_size * x,
+                              self.height_indent + self.dot_size * 0.50 // 2 + self.dot_size * y,
+                              size=int(self.dot_size * 0.50), button_id=dot - 0x10)
+            case _ if 0x20 <= dot <= 0x2F:
+                return Gate(self.scene, self.width_indent + self.dot_size * x,
+                            self.height_indent + self.dot_size * y,
+                            size=int(self.dot_size), gate_id=dot - 0x20, type_or=True)
+            case _ if 0x30 <= dot <= 0x3F:
+                return Gate(self.scene, self.width_indent + self.dot_size * x,
+                            self.height_indent + self.dot_size * y,
+                            size=int(self.dot_size), gate_id=dot - 0x30, type_or=False)
+            case _ if 0xF0 <= dot <= 0xF7:
+                return Player(self.scene, self.width_indent + self.dot_size * 0.25 // 2 + self.dot_size * x,
+                              self.height_indent + self.dot_size * 0.25 // 2 + self.dot_size * y,
+                              size=int(self.dot_size * 0.75), player_id=dot - 0xF0,
+                              base_speed=self.dot_size // 10)
+            case 0x03:
+                return Win(self.scene, self.width_indent - self.dot_size * 0.25 // 2 + self.dot_size * x,
+                           self.height_indent - self.dot_size * 0.25 // 2 + self.dot_size * y,
+                           size=int(self.dot_size * 1.25), win_callbacks=(self.win,))
+        return None
 
     def kill_sprites(self):
-        for sprite in self.sprites:
-            sprite.kill()
-        self.game_timer.kill()
+        self.sprites.clear()
+        self.scene.clear()
+        self.game_timer = None
 
     def restart(self):
         self.kill_sprites()
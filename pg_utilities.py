@@ -2,10 +2,13 @@ from math import sqrt
 from typing import Tuple
 
 from pygame.image import load as img_load
-from pygame import Color
+from pygame import Color, Rect
+from pygame.sprite import LayeredDirty
 from os.path import join, isfile
 from sys import exit as sys_exit
 
+from level_format import read_level, read_txt_level, write_level, ZLIB
+
 
 def load_image(name, colorkey=None):
     fullname = join('data', name)
@@ -24,12 +27,7 @@ def load_image(name, colorkey=None):
 
 
 def read_bin_level_data(path):
-    with open(path, 'rb') as file:
-        lvl_width = int.from_bytes(file.read(1))
-        lvl_height = int.from_bytes(file.read(1))
-        return tuple(tuple(
-            int.from_bytes(file.read(1)) for _ in range(lvl_width)
-        ) for _ in range(lvl_height))
+    return read_level(path)
 
 
 def player_color(color_code: int):
@@ -56,6 +54,11 @@ def rough_hsva_color(color_code, rough=361, h=360, s=100, v=100, a=100):
     return color
 
 
+PLAYER_COLORS = tuple(player_color(color_code) for color_code in range(8))
+BUTTON_COLORS = tuple(tuple(button_color(color_code, active) for color_code in range(16))
+                      for active in (False, True))
+
+
 def normalize_vector(vector):
     length = sqrt(vector[0] ** 2 + vector[1] ** 2)
     if length != 0:
@@ -78,6 +81,22 @@ class Mutable:
         return str(self.value)
 
 
+class DirtyGroup(LayeredDirty):
+    # LayeredDirty reports both the drawn and the current rect of a removed
+    # sprite, so translucent sprites under them were blended twice.
+    def draw(self, surface, bgsurf=None, special_flags=None):
+        merged = []
+        for rect in self.lostsprites:
+            rect = Rect(rect)
+            i = rect.collidelist(merged)
+            while i > -1:
+                rect.union_ip(merged.pop(i))
+                i = rect.collidelist(merged)
+            merged.append(rect)
+        self.lostsprites[:] = merged
+        return super().draw(surface, bgsurf, special_flags)
+
+
 def flatten(matrix: list[list[int]]) -> Tuple[int]:
     h = len(matrix)
     w = len(matrix[0])
@@ -85,17 +104,8 @@ def flatten(matrix: list[list[int]]) -> Tuple[int]:
 
 
 def read_txt_level_data(path):
-    with open(path, 'r', encoding="UTF-8") as file:
-        data = file.readlines()
-    return tuple(tuple(map(lambda x: int(x, 16), line.rstrip().split(", "))) for line in data)
-
-
-def write_level_in_bin(level_data, path):
-    width, height = len(level_data[0]), len(level_data)
-    with open(path, "wb") as file:
-        file.write(bytes((width, height, *flatten(level_data))))
+    return tuple(map(tuple, read_txt_level(path)))
 
 
-if __name__ == '__main__':
-    lvl = read_txt_level_data("data/levels/level4.txt")
-    write_level_in_bin(lvl, "data/levels/level4.bin")
+def write_level_in_bin(level_data, path, version=None, compression=ZLIB):
+    write_level(level_data, path, version, compression)
@@ -0,0 +1,86 @@
+import csv
+import json
+from collections import deque
+from time import perf_counter
+
+MAX_FRAMES = 36000
+
+
+def percentile(values, q):
+    if not values:
+        return 0.
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+def summarize(values):
+    return {
+        'mean': sum(values) / len(values) if values else 0.,
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values, default=0.),
+    }
+
+
+class FrameProfiler:
+    # Timings are kept in milliseconds.
+    def __init__(self, max_frames=MAX_FRAMES):
+        self.enabled = False
+        self.frames = deque(maxlen=max_frames)
+        self.timings = {}
+        self.counters = {}
+        self.frame_start = 0.
+        self.last_mark = 0.
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.timings = {}
+        self.counters = {}
+        self.frame_start = self.last_mark = perf_counter()
+
+    def mark(self, section):
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.timings[section] = self.timings.get(section, 0.) + (now - self.last_mark) * 1000
+        self.last_mark = now
+
+    def add(self, section, milliseconds):
+        self.timings[section] = self.timings.get(section, 0.) + milliseconds
+
+    def count(self, counter, number=1):
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + number
+
+    def end_frame(self):
+        if not self.enabled or not self.frame_start:
+            return
+        self.frames.append({'frame': (perf_counter() - self.frame_start) * 1000, **self.timings, **self.counters})
+        self.frame_start = 0.
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.frame_start = 0.
+
+    def metrics(self):
+        names = []
+        for frame in self.frames:
+            names.extend(name for name in frame if name not in names)
+        return names
+
+    def summary(self):
+        return {name: summarize([frame.get(name, 0) for frame in self.frames]) for name in self.metrics()}
+
+    def export(self, path):
+        summary = self.summary()
+        with open(path, 'w', encoding='UTF-8', newline='') as file:
+            if path.endswith('.csv'):
+                writer = csv.writer(file)
+                writer.writerow(('metric', 'mean', 'p50', 'p95', 'p99', 'max'))
+                for name, values in summary.items():
+                    writer.writerow((name, *values.values()))
+            else:
+                json.dump({'frames': len(self.frames), 'summary': summary, 'samples': list(self.frames)},
+                          file, indent=1)
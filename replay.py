@@ -0,0 +1,198 @@
+import hashlib
+import os
+import struct
+from argparse import ArgumentParser
+from datetime import datetime
+from time import perf_counter
+
+import pygame
+
+from controls import InputState
+from models import LevelWindow
+from profiler import summarize
+from simulation import Simulation
+
+# Header, then the level path, then one (tick delta varint, input mask) pair
+# for every tick where the pressed keys changed.
+MAGIC = b'AIRR'
+VERSION = 1
+HEADER = struct.Struct('<4sBB20sIH')
+REPLAY_EXTENSION = '.airr'
+
+
+def pack_inputs(inputs: InputState):
+    mask = 0
+    for i, pressed in enumerate(inputs):
+        mask |= bool(pressed) << i
+    return mask
+
+
+def unpack_inputs(mask):
+    return InputState(*(bool(mask >> i & 1) for i in range(len(InputState._fields))))
+
+
+def write_varint(data: bytearray, value):
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def level_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+def replay_path(directory, level_path):
+    name = f'{os.path.splitext(os.path.basename(level_path))[0]}-{datetime.now():%Y%m%d-%H%M%S}'
+    path = os.path.join(directory, name + REPLAY_EXTENSION)
+    number = 1
+    while os.path.exists(path):
+        number += 1
+        path = os.path.join(directory, f'{name}-{number}{REPLAY_EXTENSION}')
+    return path
+
+
+class Replay:
+    def __init__(self, level_path, active_player=0, level_digest=None, ticks=0, changes=()):
+        self.level_path = level_path
+        self.active_player = active_player
+        self.level_digest = level_digest if level_digest is not None else level_hash(level_path)
+        self.ticks = ticks
+        self.changes = list(changes)
+
+    def inputs(self):
+        changes = iter(self.changes)
+        next_tick, next_mask = next(changes, (None, 0))
+        inputs = InputState()
+        for tick in range(self.ticks):
+            if tick == next_tick:
+                inputs = unpack_inputs(next_mask)
+                next_tick, next_mask = next(changes, (None, 0))
+            yield inputs
+
+    def check_level(self):
+        if level_hash(self.level_path) != self.level_digest:
+            raise ValueError(f"'{self.level_path}' changed since the replay was recorded")
+
+    def encode(self):
+        path = self.level_path.encode('UTF-8')
+        data = bytearray(HEADER.pack(MAGIC, VERSION, self.active_player, self.level_digest, self.ticks, len(path)))
+        data += path
+        last_tick = 0
+        for tick, mask in self.changes:
+            write_varint(data, tick - last_tick)
+            data.append(mask)
+            last_tick = tick
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data):
+        if len(data) < HEADER.size:
+            raise ValueError("Not a replay file")
+        magic, version, active_player, digest, ticks, path_size = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a replay file")
+        offset = HEADER.size + path_size
+        if offset > len(data):
+            raise ValueError("Corrupt replay")
+        try:
+            level_path = data[HEADER.size:offset].decode('UTF-8')
+            changes = []
+            tick = 0
+            while offset < len(data):
+                delta, offset = read_varint(data, offset)
+                tick += delta
+                changes.append((tick, data[offset]))
+                offset += 1
+        except (IndexError, UnicodeDecodeError):
+            raise ValueError("Corrupt replay") from None
+        return cls(level_path, active_player, digest, ticks, changes)
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.encode())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.decode(file.read())
+
+
+class ReplayRecorder(Replay):
+    def __init__(self, level_path, active_player=0):
+        super().__init__(level_path, active_player)
+        self.last_mask = 0
+
+    def record(self, inputs: InputState):
+        mask = pack_inputs(inputs)
+        if mask != self.last_mask:
+            self.changes.append((self.ticks, mask))
+            self.last_mask = mask
+        self.ticks += 1
+
+
+def play_fast(replay):
+    simulation = Simulation(replay.level_path)
+    simulation.scene.active_player_id.set(replay.active_player)
+    frame_times = []
+    for inputs in replay.inputs():
+        start = perf_counter()
+        won = simulation.step(inputs)
+        frame_times.append((perf_counter() - start) * 1000)
+        if won:
+            break
+    return simulation.won, frame_times
+
+
+def play_real_time(replay, tick_rate=60, window_size=(1000, 800)):
+    pygame.font.init()
+    pygame.init()
+    screen = pygame.display.set_mode(window_size)
+    clock = pygame.time.Clock()
+    window = LevelWindow(replay.level_path, dot_size=64, window_width=window_size[0], window_height=window_size[1])
+    window.scene.active_player_id.set(replay.active_player)
+    frame_times = []
+    for inputs in replay.inputs():
+        if any(event.type == pygame.QUIT for event in pygame.event.get()):
+            break
+        start = perf_counter()
+        window.scene.input_state.set(inputs)
+        window.scene.scheduler.update()
+        pygame.display.update(window.draw(screen))
+        frame_times.append((perf_counter() - start) * 1000)
+        if window.switch_window:
+            break
+        clock.tick(tick_rate)
+    won = bool(window.switch_window)
+    window.kill_sprites()
+    return won, frame_times
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Play back a recorded session.')
+    parser.add_argument('replay')
+    parser.add_argument('-f', '--fast', action='store_true', help='run uncapped without rendering')
+    args = parser.parse_args()
+
+    session = Replay.load(args.replay)
+    session.check_level()
+    play_start = perf_counter()
+    session_won, session_frames = (play_fast if args.fast else play_real_time)(session)
+    seconds = perf_counter() - play_start
+
+    stats = summarize(session_frames)
+    print(f'{session.level_path}: {len(session_frames)}/{session.ticks} ticks in {seconds:.2f}s '
+          f'({len(session_frames) / seconds:.0f} ticks/s), {"won" if session_won else "not won"}')
+    print('tick ms: ' + ', '.join(f'{name} {value:.3f}' for name, value in stats.items()))
@@ -0,0 +1,201 @@
+import hashlib
+import math
+import os
+import struct
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+
+import numpy as np
+
+# runs.log is append-only: one fixed-size record per finished run. index/
+# holds one small file per (level, player count) with the best time, a ring of
+# the latest runs and a Fenwick tree counting runs per time bucket, so no
+# lookup ever reads the log. log.pos is how many records the index covers; the
+# rest of the log is indexed when the history is opened.
+HISTORY_DIRECTORY = os.path.join('data', 'history')
+RECORD = struct.Struct('<8sBIq')
+MAX_TIME_MS = 2 ** 32 - 1
+RECENT = 16
+# Bucket edges are 2 ** (1 / 128) apart (about 0.5 %), covering 0 to 655 seconds.
+BUCKETS = 2048
+BUCKETS_PER_OCTAVE = 128
+
+COUNT, BEST, BEST_TIMESTAMP, NEXT_RECORD, NEXT_RECENT = range(5)
+RECENT_TIMES = 5
+RECENT_TIMESTAMPS = RECENT_TIMES + RECENT
+TREE = RECENT_TIMESTAMPS + RECENT - 1
+INDEX_SIZE = TREE + BUCKETS + 1
+
+
+def level_key(level_path):
+    return hashlib.sha1(os.path.normpath(level_path).encode('UTF-8')).digest()[:8]
+
+
+def time_bucket(time_ms):
+    return min(BUCKETS - 1, int(math.log2(1 + time_ms / 10) * BUCKETS_PER_OCTAVE))
+
+
+def bucket_time(bucket):
+    return round(10 * (2 ** ((bucket + 0.5) / BUCKETS_PER_OCTAVE) - 1))
+
+
+def open_array(path, size, create=True):
+    if os.path.exists(path):
+        return np.memmap(path, np.int64, 'r+', shape=(size,))
+    if create:
+        return np.memmap(path, np.int64, 'w+', shape=(size,))
+    return None
+
+
+class RunHistory:
+    def __init__(self, directory=HISTORY_DIRECTORY):
+        self.directory = directory
+        self.log = None
+        self.position = None
+        self.indexes = {}
+
+    def open(self):
+        if self.log is not None:
+            return
+        os.makedirs(os.path.join(self.directory, 'index'), exist_ok=True)
+        self.log = open(os.path.join(self.directory, 'runs.log'), 'a+b')
+        size = self.log.seek(0, os.SEEK_END)
+        if size % RECORD.size:
+            # The last write was cut short.
+            self.log.truncate(size - size % RECORD.size)
+        self.position = open_array(os.path.join(self.directory, 'index', 'log.pos'), 1)
+        self.catch_up()
+
+    def close(self):
+        if self.log is None:
+            return
+        for index in self.indexes.values():
+            index.flush()
+        self.position.flush()
+        self.log.close()
+        self.log = None
+        self.position = None
+        self.indexes.clear()
+
+    def catch_up(self):
+        records = self.log.seek(0, os.SEEK_END) // RECORD.size
+        record = int(self.position[0])
+        if record >= records:
+            return
+        self.log.seek(record * RECORD.size)
+        for key, players, time_ms, timestamp in RECORD.iter_unpack(self.log.read()):
+            self.apply(record, key, players, time_ms, timestamp)
+            record += 1
+        self.position[0] = record
+
+    def rebuild(self):
+        self.open()
+        for name in os.listdir(os.path.join(self.directory, 'index')):
+            if name.endswith('.idx'):
+                self.index_for(bytes.fromhex(name[:16]), int(name[17:-4]))[:] = 0
+        self.position[0] = 0
+        self.catch_up()
+
+    def index_for(self, key, players, create=False):
+        index = self.indexes.get((key, players))
+        if index is None:
+            index = open_array(os.path.join(self.directory, 'index', f'{key.hex()}-{players}.idx'), INDEX_SIZE, create)
+            if index is not None:
+                self.indexes[key, players] = index
+        return index
+
+    def apply(self, record, key, players, time_ms, timestamp):
+        index = self.index_for(key, players, create=True)
+        if record < index[NEXT_RECORD]:
+            return
+        index[NEXT_RECORD] = record + 1
+        if not index[COUNT] or time_ms < index[BEST]:
+            index[BEST] = time_ms
+            index[BEST_TIMESTAMP] = timestamp
+        index[COUNT] += 1
+        slot = index[NEXT_RECENT]
+        index[RECENT_TIMES + slot] = time_ms
+        index[RECENT_TIMESTAMPS + slot] = timestamp
+        index[NEXT_RECENT] = (slot + 1) % RECENT
+        i = time_bucket(time_ms) + 1
+        while i <= BUCKETS:
+            index[TREE + i] += 1
+            i += i & -i
+
+    def add(self, level_path, players, time_ms, timestamp=None):
+        self.open()
+        time_ms = min(int(time_ms), MAX_TIME_MS)
+        timestamp = int(time.time()) if timestamp is None else int(timestamp)
+        key = level_key(level_path)
+        record = int(self.position[0])
+        self.log.write(RECORD.pack(key, players, time_ms, timestamp))
+        self.log.flush()
+        self.apply(record, key, players, time_ms, timestamp)
+        self.position[0] = record + 1
+
+    def find(self, level_path, players):
+        self.open()
+        index = self.index_for(level_key(level_path), players)
+        if index is None or not index[COUNT]:
+            return None
+        return index
+
+    def runs(self, level_path, players):
+        index = self.find(level_path, players)
+        return 0 if index is None else int(index[COUNT])
+
+    def best(self, level_path, players):
+        index = self.find(level_path, players)
+        return None if index is None else (int(index[BEST]), int(index[BEST_TIMESTAMP]))
+
+    def percentile(self, level_path, players, q):
+        # Walks down the Fenwick tree to the bucket holding the run of rank q.
+        index = self.find(level_path, players)
+        if index is None:
+            return None
+        rank = max(1, math.ceil(int(index[COUNT]) * q / 100))
+        position = 0
+        step = BUCKETS
+        while step:
+            if index[TREE + position + step] < rank:
+                position += step
+                rank -= index[TREE + position]
+            step >>= 1
+        return max(bucket_time(position), int(index[BEST]))
+
+    def median(self, level_path, players):
+        return self.percentile(level_path, players, 50)
+
+    def recent(self, level_path, players):
+        index = self.find(level_path, players)
+        if index is None:
+            return []
+        count = min(int(index[COUNT]), RECENT)
+        slots = ((int(index[NEXT_RECENT]) - i - 1) % RECENT for i in range(count))
+        return [(int(index[RECENT_TIMES + slot]), int(index[RECENT_TIMESTAMPS + slot])) for slot in slots]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Show personal bests from the run history.')
+    parser.add_argument('level')
+    parser.add_argument('-p', '--players', type=int, default=1)
+    parser.add_argument('-d', '--directory', default=HISTORY_DIRECTORY)
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the index from the log')
+    args = parser.parse_args()
+
+    history = RunHistory(args.directory)
+    if args.rebuild:
+        start = time.perf_counter()
+        history.rebuild()
+        print(f'Indexed {int(history.position[0])} runs in {time.perf_counter() - start:.2f}s')
+    best = history.best(args.level, args.players)
+    if best is None:
+        print(f'No runs of {args.level} with {args.players} player(s)')
+    else:
+        print(f'{args.level}, {args.players} player(s): {history.runs(args.level, args.players)} runs')
+        print(f'best {best[0] / 1000:.2f}s on {datetime.fromtimestamp(best[1]):%Y-%m-%d %H:%M}, '
+              f'median {history.median(args.level, args.players) / 1000:.2f}s')
+        for time_ms, timestamp in history.recent(args.level, args.players):
+            print(f'  {datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M}  {time_ms / 1000:.2f}s')
+    history.close()
@@ -0,0 +1,46 @@
+from pygame.sprite import Group
+
+from pg_utilities import Mutable, DirtyGroup
+from collision import CollisionGrid
+from logic import LogicCircuit
+from controls import InputState
+from entities import EntityStore
+from scheduler import UpdateScheduler
+from single_objects import profiler
+
+
+class Scene:
+    # Everything one window's sprites share. Scenes are independent of each
+    # other, so several levels can run side by side in one process.
+    def __init__(self):
+        self.all_sprites = DirtyGroup()
+        self.button_sprites = Group()
+        self.gate_sprites = Group()
+        self.player_sprites = Group()
+        self.win_sprites = Group()
+        self.hud_sprites = Group()
+        # Kept across clear(), e.g. the profiler overlay main.py carries along.
+        self.persistent_sprites = Group()
+
+        self.active_player_id = Mutable(0)
+        self.number_players = Mutable(1)
+        self.input_state = Mutable(InputState())
+        self.player_inputs = None
+
+        self.collision_grid = CollisionGrid(profiler=profiler)
+        self.logic_circuit = LogicCircuit()
+        self.entity_store = EntityStore()
+        self.scheduler = UpdateScheduler(self.all_sprites, profiler=profiler)
+
+    def clear(self):
+        # Sprites in dormant camera chunks are out of all_sprites but still in
+        # their own groups.
+        for group in (self.all_sprites, self.button_sprites, self.gate_sprites, self.player_sprites,
+                      self.win_sprites, self.hud_sprites):
+            for sprite in group.sprites():
+                if not self.persistent_sprites.has(sprite):
+                    sprite.kill()
+        self.collision_grid.reset(0, 0)
+        self.logic_circuit.reset()
+        self.entity_store.reset()
+        self.scheduler.reset(self.scheduler.cell_size)
@@ -0,0 +1,76 @@
+from time import perf_counter
+
+
+class UpdateScheduler:
+    def __init__(self, group, cell_size=64, profiler=None):
+        self.group = group
+        self.profiler = profiler
+        self.always = {}
+        self.awake = {}
+        self.pointers = {}
+        self.sensors = {}
+        self.cell_size = cell_size
+
+    def reset(self, cell_size=64):
+        self.always.clear()
+        self.awake.clear()
+        self.pointers.clear()
+        self.sensors.clear()
+        self.cell_size = cell_size
+
+    def cells(self, rect):
+        for cell_x in range(int(rect.left // self.cell_size), int((rect.right - 1) // self.cell_size) + 1):
+            for cell_y in range(int(rect.top // self.cell_size), int((rect.bottom - 1) // self.cell_size) + 1):
+                yield cell_x, cell_y
+
+    def add(self, sprite):
+        self.always[sprite] = None
+
+    def add_sensor(self, sprite):
+        for cell in self.cells(sprite.rect):
+            self.sensors.setdefault(cell, []).append(sprite)
+        self.wake(sprite)
+
+    def add_pointer(self, sprite):
+        self.pointers[sprite] = None
+
+    def wake(self, sprite):
+        self.awake[sprite] = None
+
+    def wake_area(self, rect):
+        for cell in self.cells(rect):
+            for sprite in self.sensors.get(cell, ()):
+                if sprite.rect.colliderect(rect):
+                    self.awake[sprite] = None
+
+    def wake_point(self, position):
+        # The click is latched on the sprite, so a press released before the
+        # next tick still counts.
+        for sprite in self.pointers:
+            if sprite.rect.collidepoint(position):
+                sprite.clicked = True
+                self.awake[sprite] = None
+
+    def update(self):
+        # Sensors woken by the always-updated sprites (a player stepping on
+        # a button) are updated in the same tick.
+        for sprite in tuple(self.always):
+            if not sprite.alive():
+                del self.always[sprite]
+            elif self.group.has(sprite):
+                self.update_sprite(sprite)
+        awake, self.awake = self.awake, {}
+        for sprite in awake:
+            if self.group.has(sprite):
+                self.update_sprite(sprite)
+        for sprite in tuple(self.pointers):
+            if not sprite.alive():
+                del self.pointers[sprite]
+
+    def update_sprite(self, sprite):
+        if self.profiler is not None and self.profiler.enabled:
+            start = perf_counter()
+            sprite.update()
+            self.profiler.add(f'update.{type(sprite).__name__}', (perf_counter() - start) * 1000)
+        else:
+            sprite.update()
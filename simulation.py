@@ -0,0 +1,53 @@
+import pygame
+
+from controls import InputState
+from models import LevelWindow
+from scene import Scene
+
+TICK_RATE = 60
+
+
+class Simulation:
+    def __init__(self, path, dot_size=64, window_width=1000, window_height=800, scene: Scene = None):
+        pygame.font.init()
+        self.window = LevelWindow(path, dot_size=dot_size,
+                                  window_width=window_width, window_height=window_height,
+                                  headless=True, scene=scene)
+        self.scene = self.window.scene
+        self.ticks = 0
+
+    @property
+    def won(self):
+        return bool(self.window.switch_window)
+
+    @property
+    def time(self):
+        return self.ticks / TICK_RATE
+
+    def step(self, inputs: InputState = InputState()):
+        self.scene.input_state.set(inputs)
+        self.scene.scheduler.update()
+        self.ticks += 1
+        return self.won
+
+    def run(self, inputs, max_ticks=None):
+        for tick, tick_inputs in enumerate(inputs):
+            if self.step(tick_inputs) or tick + 1 == max_ticks:
+                break
+        return self.won
+
+    def restart(self):
+        self.scene.active_player_id.set(0)
+        self.window.restart()
+        self.window.switch_window = None
+        self.ticks = 0
+
+    def state(self):
+        return {
+            'tick': self.ticks,
+            'active_player': int(self.scene.active_player_id),
+            'players': {player.player_id: player.rect.topleft for player in self.scene.player_sprites},
+            'buttons': [button.active for button in self.scene.button_sprites],
+            'gates': [gate.active for gate in self.scene.gate_sprites],
+            'won': self.won,
+        }
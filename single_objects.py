@@ -1,12 +1,7 @@
-from pygame.sprite import Group
-from pg_utilities import Mutable
+from level_cache import LevelCache
+from profiler import FrameProfiler
+from run_history import RunHistory
 
-all_sprites = Group()
-wall_sprites = Group()
-button_sprites = Group()
-gate_sprites = Group()
-player_sprites = Group()
-win_sprites = Group()
-
-active_player_id = Mutable(0)
-number_players = Mutable(1)
+profiler = FrameProfiler()
+level_cache = LevelCache()
+run_history = RunHistory()
@@ -0,0 +1,158 @@
+import heapq
+from argparse import ArgumentParser
+from collections import deque
+from itertools import count
+from multiprocessing import Pool
+from time import perf_counter
+
+from pg_utilities import read_bin_level_data
+
+MAX_STATES = 5_000_000
+INFINITE = float('inf')
+SOLVED, UNREACHABLE, GAVE_UP = range(3)
+
+
+class TileLevel:
+    def __init__(self, level):
+        self.width, self.height = len(level[0]), len(level)
+        cells = tuple(dot for line in level for dot in line)
+        self.walls = tuple(dot == 0x01 for dot in cells)
+        self.players = tuple(i for i, dot in enumerate(cells) if 0xF0 <= dot <= 0xF7)
+        self.buttons = {i: dot - 0x10 for i, dot in enumerate(cells) if 0x10 <= dot <= 0x1F}
+        self.gates = {i: (dot & 0x0F, dot < 0x30) for i, dot in enumerate(cells) if 0x20 <= dot <= 0x3F}
+        # The game only builds AND wins (0x03); OR wins (0x02) can't be won yet.
+        self.wins = frozenset(i for i, dot in enumerate(cells) if dot == 0x03)
+        self.or_wins = frozenset(i for i, dot in enumerate(cells) if dot == 0x02)
+        self.button_totals = [0] * 16
+        for button_id in self.buttons.values():
+            self.button_totals[button_id] += 1
+        self.cell_bits = max(1, (len(cells) - 1).bit_length())
+        self.neighbours = tuple(self.open_neighbours(i) for i in range(len(cells)))
+        self.distances = self.distance_map(self.wins)
+
+    def open_neighbours(self, cell):
+        y, x = divmod(cell, self.width)
+        neighbours = []
+        for nx, ny in ((x, y - 1), (x - 1, y), (x, y + 1), (x + 1, y)):
+            if 0 <= nx < self.width and 0 <= ny < self.height and not self.walls[ny * self.width + nx]:
+                neighbours.append(ny * self.width + nx)
+        return tuple(neighbours)
+
+    def distance_map(self, targets):
+        # Gates are ignored, so these are lower bounds on the moves a player needs.
+        distances = [INFINITE] * len(self.walls)
+        queue = deque(targets)
+        for cell in targets:
+            distances[cell] = 0
+        while queue:
+            cell = queue.popleft()
+            for neighbour in self.neighbours[cell]:
+                if distances[neighbour] == INFINITE:
+                    distances[neighbour] = distances[cell] + 1
+                    queue.append(neighbour)
+        return distances
+
+    def button_masks(self, players):
+        pressed = [0] * 16
+        for cell in set(players):
+            button_id = self.buttons.get(cell)
+            if button_id is not None:
+                pressed[button_id] += 1
+        pressed_any = pressed_all = 0
+        for button_id, number in enumerate(pressed):
+            if number:
+                pressed_any |= 1 << button_id
+                if number == self.button_totals[button_id]:
+                    pressed_all |= 1 << button_id
+        return pressed_any, pressed_all
+
+    def is_solid(self, cell, pressed_any, pressed_all):
+        gate = self.gates.get(cell)
+        if gate is None:
+            return False
+        gate_id, type_or = gate
+        return not ((pressed_any if type_or else pressed_all) >> gate_id & 1)
+
+    def encode(self, players, pressed_any):
+        key = 0
+        for cell in players:
+            key = key << self.cell_bits | cell
+        return key << 16 | pressed_any
+
+    def is_won(self, players):
+        return players[0] in self.wins and players[0] == players[-1]
+
+    def heuristic(self, players):
+        return sum(self.distances[cell] for cell in players)
+
+    def successors(self, players):
+        pressed_any, pressed_all = self.button_masks(players)
+        for i, cell in enumerate(players):
+            if (i and players[i - 1] == cell) or self.is_solid(cell, pressed_any, pressed_all):
+                continue
+            for neighbour in self.neighbours[cell]:
+                if not self.is_solid(neighbour, pressed_any, pressed_all):
+                    yield tuple(sorted(players[:i] + (neighbour,) + players[i + 1:]))
+
+    def solve(self, max_states=MAX_STATES):
+        # Players follow the same rules, so a state only keeps their sorted cells.
+        # Ties on the estimate are broken towards deeper states.
+        start = tuple(sorted(self.players))
+        start_cost = self.heuristic(start)
+        if start_cost == INFINITE:
+            return UNREACHABLE, None, 1
+        tie = count()
+        visited = {self.encode(start, self.button_masks(start)[0]): 0}
+        frontier = [(start_cost, 0, next(tie), start)]
+        while frontier:
+            _, moves, _, players = heapq.heappop(frontier)
+            moves = -moves
+            if self.is_won(players):
+                return SOLVED, moves, len(visited)
+            for state in self.successors(players):
+                key = self.encode(state, self.button_masks(state)[0])
+                if visited.get(key, INFINITE) <= moves + 1:
+                    continue
+                cost = self.heuristic(state)
+                if cost == INFINITE:
+                    continue
+                visited[key] = moves + 1
+                heapq.heappush(frontier, (moves + 1 + cost, -moves - 1, next(tie), state))
+            if len(visited) > max_states:
+                return GAVE_UP, None, len(visited)
+        return UNREACHABLE, None, len(visited)
+
+
+def solve_level(path, max_states=MAX_STATES):
+    start_time = perf_counter()
+    level = TileLevel(read_bin_level_data(path))
+    if not level.players:
+        return path, 'no players', 0, perf_counter() - start_time
+    if not level.wins:
+        result = 'no playable win tile (OR wins are not in the game yet)' if level.or_wins else 'no win tile'
+        return path, result, 0, perf_counter() - start_time
+    status, moves, states = level.solve(max_states)
+    if status == UNREACHABLE:
+        result = 'unreachable'
+    elif status == GAVE_UP:
+        result = f'gave up after {max_states} states'
+    else:
+        result = f'{moves} moves'
+    return path, result, states, perf_counter() - start_time
+
+
+def solve_levels(paths, processes=None, max_states=MAX_STATES):
+    with Pool(processes) as pool:
+        yield from pool.starmap(solve_level, ((path, max_states) for path in paths))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Check that levels can be won at the tile level.')
+    parser.add_argument('levels', nargs='+')
+    parser.add_argument('-p', '--processes', type=int, default=None)
+    parser.add_argument('--max-states', type=int, default=MAX_STATES)
+    args = parser.parse_args()
+
+    for level_path, level_result, level_states, seconds in solve_levels(args.levels, args.processes,
+                                                                      args.max_states):
+        print(f'{level_path}: {level_result} ({level_states} states, {seconds:.2f}s)')
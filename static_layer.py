@@ -0,0 +1,67 @@
+import pygame
+
+from images import tile_image
+
+CHUNK_TILES = 16
+STATIC_TILES = {0x01: 'wall'}
+
+
+class StaticLayer:
+    def __init__(self, level, cell_size=64, x=0, y=0, chunk_tiles=CHUNK_TILES):
+        self.level = level
+        self.width = len(level[0])
+        self.height = len(level)
+        self.cell_size = cell_size
+        self.x = x
+        self.y = y
+        self.chunk_tiles = chunk_tiles
+        self.chunk_size = chunk_tiles * cell_size
+        self.chunks = {}
+        self.bytes = 0
+
+    def chunk(self, chunk_x, chunk_y):
+        # Chunks are painted on first use; chunks without static tiles stay None.
+        if (chunk_x, chunk_y) in self.chunks:
+            return self.chunks[chunk_x, chunk_y]
+        surface = None
+        first_column, first_row = chunk_x * self.chunk_tiles, chunk_y * self.chunk_tiles
+        columns = min(self.chunk_tiles, self.width - first_column)
+        rows = min(self.chunk_tiles, self.height - first_row)
+        for row in range(rows):
+            line = self.level[first_row + row]
+            for column in range(columns):
+                kind = STATIC_TILES.get(line[first_column + column])
+                if kind is not None:
+                    if surface is None:
+                        surface = pygame.Surface((columns * self.cell_size, rows * self.cell_size),
+                                                 pygame.SRCALPHA, 32)
+                        self.bytes += surface.get_width() * surface.get_height() * surface.get_bytesize()
+                    surface.blit(tile_image(kind, 'white', size=self.cell_size),
+                                 (column * self.cell_size, row * self.cell_size))
+        self.chunks[chunk_x, chunk_y] = surface
+        return surface
+
+    def chunk_keys(self, area):
+        first_x = max(int((area.left - self.x) // self.chunk_size), 0)
+        last_x = min(int((area.right - 1 - self.x) // self.chunk_size), (self.width - 1) // self.chunk_tiles)
+        first_y = max(int((area.top - self.y) // self.chunk_size), 0)
+        last_y = min(int((area.bottom - 1 - self.y) // self.chunk_size), (self.height - 1) // self.chunk_tiles)
+        return {(chunk_x, chunk_y) for chunk_x in range(first_x, last_x + 1)
+                for chunk_y in range(first_y, last_y + 1)}
+
+    def blit(self, surface, offset=(0, 0)):
+        for chunk_x, chunk_y in self.chunk_keys(surface.get_clip().move(offset)):
+            chunk = self.chunk(chunk_x, chunk_y)
+            if chunk is not None:
+                surface.blit(chunk, (self.x + chunk_x * self.chunk_size - offset[0],
+                                     self.y + chunk_y * self.chunk_size - offset[1]))
+
+    def release(self, keep):
+        for key in self.chunks.keys() - keep:
+            chunk = self.chunks.pop(key)
+            if chunk is not None:
+                self.bytes -= chunk.get_width() * chunk.get_height() * chunk.get_bytesize()
+
+    def size(self):
+        # Chunks are painted and released as the camera moves, so this changes.
+        return self.bytes